@@ -0,0 +1,66 @@
+# -*- coding: utf-8; -*-
+
+import logging
+
+import pygame
+
+logger = logging.getLogger("platakart.atlas")
+
+DEFAULT_SIZE = (512, 512)
+
+
+def has_alpha(img):
+    return bool(img.get_flags() & pygame.SRCALPHA)
+
+
+class Atlas(object):
+    """Small images packed onto shared surfaces.
+
+    Images are placed as they are loaded, left to right on shelves as
+    tall as the tallest image on them, and handed back as subsurfaces of
+    the page they are on.  A new page is started when one fills up.
+    Pages have per-pixel alpha, so they must be created after the
+    display mode is set.
+    """
+
+    def __init__(self, name, size=DEFAULT_SIZE, padding=1):
+        self.name = name
+        self.size = size
+        self.padding = padding
+        self.pages = list()
+        self.x = self.y = self.shelf_height = 0
+
+    def new_page(self):
+        page = pygame.Surface(self.size, pygame.SRCALPHA, 32).convert_alpha()
+        page.fill((0, 0, 0, 0))
+        self.pages.append(page)
+        self.x = self.y = self.shelf_height = 0
+        logger.debug("Started page %d of atlas %s"
+                     % (len(self.pages), self.name))
+        return page
+
+    def add(self, img):
+        """Copy img into the atlas and return its subsurface"""
+        width, height = img.get_size()
+        if width > self.size[0] or height > self.size[1]:
+            logger.debug("%dx%d image is too big for atlas %s"
+                         % (width, height, self.name))
+            return img
+
+        if not self.pages:
+            self.new_page()
+        if self.x + width > self.size[0]:
+            self.x = 0
+            self.y += self.shelf_height + self.padding
+            self.shelf_height = 0
+        if self.y + height > self.size[1]:
+            self.new_page()
+
+        page = self.pages[-1]
+        rect = pygame.Rect(self.x, self.y, width, height)
+        # Copy the pixels exactly; a normal blit would blend them with
+        # the empty page.
+        page.blit(img, rect, special_flags=pygame.BLEND_RGBA_MAX)
+        self.x += width + self.padding
+        self.shelf_height = max(self.shelf_height, height)
+        return page.subsurface(rect)
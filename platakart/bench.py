@@ -0,0 +1,388 @@
+# -*- coding: utf-8; -*-
+
+from __future__ import print_function
+
+from argparse import ArgumentParser
+import json
+import logging
+import os
+import os.path
+import random
+import subprocess
+import time
+
+# Benchmarks run headless.
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+import pymunk
+
+logger = logging.getLogger("platakart.bench")
+
+from platakart.atlas import Atlas
+from platakart.atlas import has_alpha
+from platakart.collision import compile_shapes
+from platakart.collision import use_spatial_hash
+from platakart.core import create_game
+from platakart.dispatch import inputs
+from platakart.rotation import RotationCache
+from platakart.track import GRAVITY
+from platakart.track import Kart
+from platakart.track import KartPerf
+from platakart.trackcache import add_shapes
+
+RESOURCE_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "resources")
+
+
+def load_image(filename):
+    img = pygame.image.load(os.path.join(RESOURCE_PATH, filename))
+    return img.convert_alpha()
+
+
+def init_display(size=(640, 480)):
+    pygame.display.init()
+    return pygame.display.set_mode(size)
+
+
+def time_frames(frames, func):
+    start = time.time()
+    for frame in range(frames):
+        func(frame)
+    return (time.time() - start) * 1000.0 / frames
+
+
+def percentile(sorted_values, pct):
+    index = int(round((len(sorted_values) - 1) * pct / 100.0))
+    return sorted_values[index]
+
+
+def summarize(frame_times):
+    values = sorted(frame_times)
+    return {"frames": len(values),
+            "mean": sum(values) / len(values),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+            "max": values[-1]}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(RESOURCE_PATH)).strip().decode("ascii")
+    except Exception:
+        return None
+
+
+def key_up(key):
+    return pygame.event.Event(pygame.KEYUP, key=key, mod=0)
+
+
+def mouse_move(pos):
+    return pygame.event.Event(pygame.MOUSEMOTION, pos=pos, rel=(0, 0),
+                              buttons=(0, 0, 0))
+
+
+# Scripted input: functions from a frame number to the events posted
+# before that frame.  None of them clicks, so no scene switches by itself.
+
+def idle_input(frame):
+    return ()
+
+
+def menu_mouse_input(frame):
+    return [mouse_move(((frame * 7) % 640, (frame * 3) % 480))]
+
+
+def track_select_input(frame):
+    events = menu_mouse_input(frame)
+    if frame % 10 == 0:
+        events.append(key_up((pygame.K_DOWN, pygame.K_UP)[frame // 10 % 2]))
+    return events
+
+
+def track_input(frame):
+    if frame % 60 == 59:
+        return [key_up(pygame.K_UP)]
+    elif frame % 4 == 0:
+        return [key_up(pygame.K_RIGHT)]
+    return ()
+
+
+# (phase name, scene name, scene options, TrackScene attributes, input)
+PHASES = (
+    ("kart-select", "kart-select", None, None, menu_mouse_input),
+    ("track-select", "track-select", {"kart_id": "veloc"}, None,
+     track_select_input),
+    ("track", "track", {"trackname": "testtrack1"},
+     {"wireframe_mode": 0, "show_mini_map": 0}, track_input),
+    ("track-mini-map", "track", {"trackname": "testtrack1"},
+     {"wireframe_mode": 0, "show_mini_map": 1}, track_input),
+    ("track-wireframe", "track", {"trackname": "testtrack1"},
+     {"wireframe_mode": 1, "show_mini_map": 0}, track_input),
+    ("track-wireframe-mini-map", "track", {"trackname": "testtrack1"},
+     {"wireframe_mode": 1, "show_mini_map": 1}, track_input),
+)
+
+
+def run_frames(game, screen, frames, script, delta, until=None):
+    """Run frames of the current scene and return each frame's time in ms"""
+    times = list()
+    post = pygame.event.post
+    for frame in range(frames):
+        if until is not None and until():
+            break
+        for event in script(frame):
+            post(event)
+        start = time.time()
+        pygame.event.pump()
+        game.dispatch_events(pygame.event.get())
+        game.current_scene.update(screen, delta)
+        times.append((time.time() - start) * 1000.0)
+    return times
+
+
+def bench_frames(args):
+    game = create_game(args.config)
+    screen = game.init_pygame()
+    delta = 1000.0 / float(game.config.get("target_fps", 30))
+    results = dict()
+
+    title = game.scenes["title"]
+    game.start()
+    times = run_frames(game, screen, args.max_load_frames, idle_input,
+                       delta, until=lambda: title.loaded)
+    results["title-loading"] = summarize(times)
+
+    for name, scene_name, options, attrs, script in PHASES:
+        scene = game.scenes[scene_name]
+        for attr, value in (attrs or dict()).items():
+            setattr(scene, attr, value)
+        start = time.time()
+        game.switch_scene(scene_name, options)
+        switch_ms = (time.time() - start) * 1000.0
+        inputs.stats()
+        times = run_frames(game, screen, args.frames, script, delta)
+        results[name] = summarize(times)
+        results[name]["switch"] = switch_ms
+        results[name]["dispatch"] = inputs.stats()
+
+    print("%-26s %7s %8s %8s %8s %8s" % (
+        "phase", "frames", "p50", "p95", "p99", "switch"))
+    for name in ["title-loading"] + [phase[0] for phase in PHASES]:
+        r = results[name]
+        print("%-26s %7d %8.3f %8.3f %8.3f %8.2f" % (
+            name, r["frames"], r["p50"], r["p95"], r["p99"],
+            r.get("switch", 0.0)))
+
+    if args.output:
+        report = {"label": args.label,
+                  "revision": git_revision(),
+                  "time": time.time(),
+                  "frames": args.frames,
+                  "phases": results}
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=2, sort_keys=True)
+        logger.info("Wrote results to %s" % args.output)
+
+
+def bench_karts(args):
+    game = create_game(args.config)
+    screen = game.init_pygame()
+    delta = 1000.0 / float(game.config.get("target_fps", 30))
+    track = game.scenes["track"]
+    game.start()
+    options = {"trackname": "testtrack1"}
+
+    print("%6s %9s %9s %9s" % ("karts", "p50", "p95", "p99"))
+    for count in args.kart_counts:
+        track.kart_count = count
+        game.switch_scene("track", options)
+        times = run_frames(game, screen, args.frames, track_input, delta)
+        r = summarize(times)
+        print("%6d %9.3f %9.3f %9.3f" % (count, r["p50"], r["p95"],
+                                         r["p99"]))
+
+
+def bench_rotation(args):
+    screen = init_display()
+    body_surf = load_image("greenkart.png")
+    wheel_surf = load_image("wheel.png")
+    perf = KartPerf(100, 8, 15)
+    cache = RotationCache(args.steps)
+
+    def make_kart(rotation_cache):
+        kart = Kart("bench", pymunk.Space(), (200, 300), body_surf,
+                    wheel_surf, perf, rotation_cache)
+        kart.init_physics()
+        return kart
+
+    def draw_frames(kart):
+        bodies = [kart.chassis] + kart.wheels
+
+        def draw(frame):
+            for body in bodies:
+                body.angle = frame * 0.037
+            kart.draw(screen)
+
+        return draw
+
+    start = time.time()
+    cached_kart = make_kart(cache)
+    build_ms = (time.time() - start) * 1000.0
+    rotozoom_ms = time_frames(args.frames, draw_frames(make_kart(None)))
+    cached_ms = time_frames(args.frames, draw_frames(cached_kart))
+    sprites, size, max_bytes = cache.report()
+
+    print("rotozoom:        %8.4f ms/frame" % rotozoom_ms)
+    print("rotation cache:  %8.4f ms/frame (%d steps)" % (
+        cached_ms, args.steps))
+    print("cache build:     %8.2f ms" % build_ms)
+    print("cache memory:    %d sprites, %d bytes (budget %d)" % (
+        sprites, size, max_bytes))
+
+
+SPRITES = ("red_button11.png", "red_button12.png", "testtrack-thumb.png",
+           "greenkart.png", "wheel.png")
+
+
+def bench_blit(args):
+    screen = init_display()
+    raw = [pygame.image.load(os.path.join(RESOURCE_PATH, filename))
+           for filename in SPRITES]
+    converted = [img.convert_alpha() if has_alpha(img) else img.convert()
+                 for img in raw]
+    atlas = Atlas("bench")
+    packed = [atlas.add(img) for img in converted]
+    background = pygame.image.load(
+        os.path.join(RESOURCE_PATH, "title.png"))
+
+    def blit_frames(images, background):
+        positions = [((i * 37) % 600, (i * 53) % 440) for i in range(50)]
+
+        def draw(frame):
+            screen.blit(background, (0, 0))
+            for pos in positions:
+                for img in images:
+                    screen.blit(img, pos)
+
+        return draw
+
+    print("%-24s %12s" % ("images", "ms/frame"))
+    for name, images, bg in (
+            ("file format", raw, background),
+            ("converted", converted, background.convert()),
+            ("converted + atlas", packed, background.convert())):
+        ms = time_frames(args.frames, blit_frames(images, bg))
+        print("%-24s %12.4f" % (name, ms))
+    print("%d sprites blitted 50 times a frame; atlas has %d page(s)"
+          % (len(SPRITES), len(atlas.pages)))
+
+
+TILE = 70
+# friction, elasticity, collision_type, group, layers, sensor
+GROUND = (0.5, 0.0, 0, 0, -1, False)
+
+
+def synthetic_track(columns, seed=0):
+    """Shapes of a long track with one box per tile, like a TMX file
+    drawn with the box tool over every ground tile."""
+    rng = random.Random(seed)
+    tile = [(0, 0), (0, TILE), (TILE, TILE), (TILE, 0)]
+    bodies = list()
+    height = 3
+    for col in range(columns):
+        if rng.random() < 0.1:
+            height = max(1, min(8, height + rng.choice((-1, 1))))
+        for row in range(height):
+            bodies.append(((None, (col * TILE, row * TILE), 0.0),
+                           [(("poly", tile), GROUND)]))
+        if col % 20 == 10:
+            for offset in range(6):
+                bodies.append((
+                    (None, ((col + offset) * TILE, (height + 3) * TILE),
+                     0.0),
+                    [(("poly", tile), GROUND)]))
+    return bodies
+
+
+def bench_collision(args):
+    columns = args.track_tiles
+    raw = synthetic_track(columns)
+    start = time.time()
+    compiled = compile_shapes(raw)
+    compile_ms = (time.time() - start) * 1000.0
+    step_amt = 1.0 / 60.0
+
+    def build(bodies, spatial_hash):
+        space = pymunk.Space()
+        space.gravity = GRAVITY
+        add_shapes(space, bodies)
+        # Balls dropped along the track stand in for karts.
+        for i in range(64):
+            body = pymunk.Body(1, pymunk.moment_for_circle(1, 0, 20))
+            body.position = ((i + 0.5) * columns * TILE / 64.0, 1000)
+            body.velocity = (200, 0)
+            space.add(body, pymunk.Circle(body, 20))
+        if spatial_hash:
+            use_spatial_hash(space, TILE)
+        return space
+
+    print("compiled %d shapes into %d in %.2f ms" % (
+        len(raw), sum(len(shapes) for body, shapes in compiled),
+        compile_ms))
+    print("%-10s %-12s %8s %12s" % ("shapes", "broadphase", "count",
+                                    "ms/step"))
+    for name, bodies in (("tiles", raw), ("compiled", compiled)):
+        for spatial_hash in (False, True):
+            space = build(bodies, spatial_hash)
+            ms = time_frames(args.frames,
+                             lambda frame: space.step(step_amt))
+            print("%-10s %-12s %8d %12.4f" % (
+                name, "spatial hash" if spatial_hash else "bb tree",
+                len(space.shapes), ms))
+
+
+BENCHMARKS = {"blit": bench_blit,
+              "collision": bench_collision,
+              "frames": bench_frames,
+              "karts": bench_karts,
+              "rotation": bench_rotation}
+
+
+def main():
+    parser = ArgumentParser(prog="platakart.bench",
+                            description="Platakart benchmarks")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--frames", type=int, default=1000,
+                        help="Number of frames to time")
+    parser.add_argument("--steps", type=int, default=64,
+                        help="Rotation cache angle buckets")
+    parser.add_argument("--kart-counts", type=int, nargs="+",
+                        default=[1, 16, 32, 64],
+                        help="Grid sizes to time the track scene with")
+    parser.add_argument("--track-tiles", type=int, default=2000,
+                        help="Length of the synthetic collision track")
+    parser.add_argument("--max-load-frames", type=int, default=10000,
+                        help="Give up loading resources after this many")
+    parser.add_argument("--config", default=None,
+                        help="Game config file (defaults are used if unset)")
+    parser.add_argument("--output", default=None,
+                        help="Write results as JSON to this file")
+    parser.add_argument("--label", default=None,
+                        help="Name for this run in the JSON results")
+    parser.add_argument(
+        "--log-level",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+        default="WARNING", help="Verbosity of logging output")
+    args = parser.parse_args()
+    logging.basicConfig(level=getattr(logging, args.log_level))
+    BENCHMARKS[args.benchmark](args)
+    pygame.quit()
+
+
+if __name__ == "__main__":
+    main()
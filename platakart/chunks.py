@@ -0,0 +1,145 @@
+# -*- coding: utf-8; -*-
+
+import logging
+from multiprocessing.pool import ThreadPool
+
+from platakart.collision import world_vertices
+from platakart.trackcache import build_shapes
+
+logger = logging.getLogger("platakart.chunks")
+
+
+def shape_extent(position, angle, geometry):
+    """Left and right edges of a static shape, in world coordinates"""
+    kind = geometry[0]
+    if kind == "poly":
+        xs = [x for x, y in world_vertices(position, angle, geometry[1])]
+        return min(xs), max(xs)
+    elif kind == "segment":
+        a, b, radius = geometry[1:]
+        xs = [x for x, y in world_vertices(position, angle, (a, b))]
+        return min(xs) - radius, max(xs) + radius
+    radius, offset = geometry[1:]
+    x = world_vertices(position, angle, (offset,))[0][0]
+    return x - radius, x + radius
+
+
+class TrackChunks(object):
+    """A track's static shapes, in the space only near the karts.
+
+    The track is cut into strips chunk_width pixels wide and every static
+    shape belongs to the strip its left edge is in.  Strips within ahead
+    strips of any kart are in the space.  The strip after that is built
+    on a background thread, so that it's ready before a kart gets close.
+    Strips that fall out of range are taken out of the space and their
+    shapes dropped.  Only the offsets of each strip's records in the
+    TrackFile's shape table are kept; the records are read again
+    whenever the strip is built.  Dynamic bodies in the track are always
+    in the space.
+    """
+
+    def __init__(self, space, track, chunk_width, ahead=1):
+        self.space = space
+        self.track = track
+        self.chunk_width = float(chunk_width)
+        self.ahead = ahead
+        # chunk -> offsets of its shape records
+        self.chunks = dict()
+        # Chunks whose shapes reach into each chunk.
+        self.covers = dict()
+        dynamic = list()
+        for offset in track.shape_offsets():
+            body, geometry, attrs = track.read_shape(offset)
+            mass, position, angle = body
+            if mass is not None:
+                dynamic.append(offset)
+                continue
+            left, right = shape_extent(position, angle, geometry)
+            first = self.index(left)
+            self.chunks.setdefault(first, list()).append(offset)
+            for i in range(first, self.index(right) + 1):
+                self.covers.setdefault(i, set()).add(first)
+        bodies, shapes = build_shapes(track.read_shapes(dynamic))
+        space.add(*(bodies + shapes))
+
+        self.attached = dict()
+        self.ready = dict()
+        self.pending = dict()
+        self.pool = ThreadPool(1)
+        self.attaches = 0
+        self.detaches = 0
+        self.waits = 0
+        logger.debug("Split track into %d chunks of %d pixels"
+                     % (len(self.chunks), self.chunk_width))
+
+    def index(self, x):
+        return int(x // self.chunk_width)
+
+    def in_range(self, xs, distance):
+        near = set()
+        for x in xs:
+            i = self.index(x)
+            for j in range(i - distance, i + distance + 1):
+                near.update(self.covers.get(j, ()))
+        return near
+
+    def build(self, index):
+        return build_shapes(self.track.read_shapes(self.chunks[index]))[1]
+
+    def take(self, index):
+        """Built shapes for a chunk, waiting for them if necessary"""
+        shapes = self.ready.pop(index, None)
+        if shapes is not None:
+            return shapes
+        result = self.pending.pop(index, None)
+        if result is None:
+            return self.build(index)
+        if not result.ready():
+            self.waits += 1
+            logger.debug("Waiting for chunk %d" % index)
+        return result.get()
+
+    def update(self, xs):
+        """Keep the chunks near the given x positions in the space.
+
+        Call between physics steps, never during one.
+        """
+        needed = self.in_range(xs, self.ahead)
+        wanted = self.in_range(xs, self.ahead + 1)
+
+        for index in list(self.attached):
+            if index not in wanted:
+                self.space.remove(*self.attached.pop(index))
+                self.detaches += 1
+        for index in needed:
+            if index not in self.attached:
+                shapes = self.take(index)
+                self.space.add(*shapes)
+                self.attached[index] = shapes
+                self.attaches += 1
+
+        for index, result in list(self.pending.items()):
+            if result.ready():
+                del self.pending[index]
+                self.ready[index] = result.get()
+        for index in list(self.ready):
+            if index not in wanted:
+                del self.ready[index]
+        for index in wanted:
+            if (index not in self.attached and index not in self.ready
+                    and index not in self.pending):
+                self.pending[index] = self.pool.apply_async(
+                    self.build, (index,))
+
+    def close(self):
+        self.pool.terminate()
+        self.pending = dict()
+        self.ready = dict()
+
+    def stats(self):
+        return {"chunks": len(self.chunks),
+                "attached": len(self.attached),
+                "shapes": sum(len(s) for s in self.attached.values()),
+                "attaches": self.attaches,
+                "detaches": self.detaches,
+                "waits": self.waits}
@@ -0,0 +1,123 @@
+# -*- coding: utf-8; -*-
+
+import logging
+import math
+
+import numpy
+
+logger = logging.getLogger("platakart.collision")
+
+# Decimal places box corners are rounded to, so corners within about
+# 0.001 pixels of each other are treated as the same edge.
+PRECISION = 3
+
+
+def world_vertices(position, angle, verts):
+    cos = math.cos(angle)
+    sin = math.sin(angle)
+    px, py = position
+    return [(px + x * cos - y * sin, py + x * sin + y * cos)
+            for x, y in verts]
+
+
+def as_box(verts):
+    """Return (left, bottom, right, top) if verts are an upright box"""
+    if len(verts) != 4:
+        return None
+    xs = sorted(set(round(x, PRECISION) for x, y in verts))
+    ys = sorted(set(round(y, PRECISION) for x, y in verts))
+    if len(xs) != 2 or len(ys) != 2:
+        return None
+    corners = set((round(x, PRECISION), round(y, PRECISION))
+                  for x, y in verts)
+    if len(corners) != 4:
+        return None
+    return xs[0], ys[0], xs[1], ys[1]
+
+
+def merge_boxes(boxes):
+    """Cover the union of boxes with as few boxes as practical.
+
+    The box edges split the plane into a grid of cells.  Covered cells
+    are joined into horizontal runs, and runs with the same extent in
+    consecutive rows are joined into one box.  The result never overlaps
+    and covers exactly the same area.
+    """
+    if not boxes:
+        return list()
+    xs = sorted(set([b[0] for b in boxes] + [b[2] for b in boxes]))
+    ys = sorted(set([b[1] for b in boxes] + [b[3] for b in boxes]))
+    col = dict((x, i) for i, x in enumerate(xs))
+    row = dict((y, j) for j, y in enumerate(ys))
+    covered = numpy.zeros((len(ys) - 1, len(xs) - 1), dtype=bool)
+    for left, bottom, right, top in boxes:
+        covered[row[bottom]:row[top], col[left]:col[right]] = True
+
+    merged = list()
+    open_runs = dict()
+    for j in range(len(ys)):
+        runs = set()
+        if j < len(ys) - 1:
+            # Starts and ends of runs are where coverage changes.
+            edges = numpy.flatnonzero(numpy.diff(
+                numpy.concatenate(([False], covered[j], [False]))))
+            runs = set(zip(edges[::2].tolist(), edges[1::2].tolist()))
+        for run in list(open_runs):
+            if run not in runs:
+                start = open_runs.pop(run)
+                merged.append((xs[run[0]], ys[start], xs[run[1]], ys[j]))
+        for run in runs:
+            open_runs.setdefault(run, j)
+    return merged
+
+
+def compile_shapes(bodies):
+    """Merge the static boxes of a track into fewer, larger boxes.
+
+    bodies is a list from extract_shapes.  Upright boxes on static
+    bodies are merged with the boxes that have the same shape attributes
+    (friction, collision type and so on) and touch or overlap them.
+    Other shapes and dynamic bodies are returned unchanged.
+    """
+    compiled = list()
+    boxes = dict()
+    box_count = 0
+    for (mass, position, angle), shapes in bodies:
+        kept = list()
+        for geometry, attrs in shapes:
+            box = None
+            if mass is None and geometry[0] == "poly":
+                box = as_box(world_vertices(position, angle, geometry[1]))
+            if box is None:
+                kept.append((geometry, attrs))
+            else:
+                boxes.setdefault(attrs, list()).append(box)
+                box_count += 1
+        if kept:
+            compiled.append(((mass, position, angle), kept))
+
+    merged_shapes = list()
+    for attrs, group in boxes.items():
+        for left, bottom, right, top in merge_boxes(group):
+            verts = [(left, bottom), (left, top), (right, top),
+                     (right, bottom)]
+            merged_shapes.append((("poly", verts), attrs))
+    if merged_shapes:
+        compiled.append(((None, (0.0, 0.0), 0.0), merged_shapes))
+
+    logger.debug("Merged %d static boxes into %d"
+                 % (box_count, len(merged_shapes)))
+    return compiled
+
+
+def use_spatial_hash(space, cell_size, min_cells=1000):
+    """Switch space from its bounding box tree to a spatial hash.
+
+    Tracks are built from tiles, so cells the size of a tile hold a
+    kart's wheel or a handful of shapes each.  Chipmunk suggests about
+    ten cells per shape.
+    """
+    count = max(min_cells, 10 * len(space.shapes))
+    space.use_spatial_hash(cell_size, count)
+    logger.debug("Using a spatial hash of %d cells of %d pixels"
+                 % (count, cell_size))
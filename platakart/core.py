@@ -1,8 +1,11 @@
 # -*- coding: utf-8; -*-
 
+from collections import OrderedDict
 import logging
 import ConfigParser
+from multiprocessing.pool import ThreadPool
 import os.path
+import time
 from pubsub import pub
 
 logger = logging.getLogger("platakart.core")
@@ -12,84 +15,336 @@ import pygame
 import pygame.event
 import pygame.font
 import pytmx
-
+import pytmx.util_pygame
+
+from platakart.atlas import Atlas
+from platakart.atlas import has_alpha
+from platakart.dispatch import inputs
+from platakart.display import SCALE_MODES
+from platakart.display import display
+from platakart.dispatch import subscriptions
+from platakart.fonts import fonts
+from platakart.music import MusicPlayer
+from platakart.voices import VoiceManager
+from platakart.profiler import FrameProfiler
+from platakart.profiler import NULL_PROFILER
 from platakart.title import TitleScene
 from platakart.kartselect import KartSelectScene
 from platakart.trackselect import TrackSelectScene
 from platakart.track import TrackScene
+from platakart.trackcache import TrackCache
+from platakart.trackcache import parse_track
+from platakart.trackfile import open_track
 
 SHOWFPSEVENT = pygame.USEREVENT + 1
 GAMETITLE = "Platakart"
 
+inputs.add_topic("game.show-fps", SHOWFPSEVENT, lambda e: ())
+
+
+def decode_image(path):
+    return pygame.image.load(path)
+
+
+def decode_sound(path):
+    return pygame.mixer.Sound(path)
+
+
+def sound_size(sound):
+    frequency, fmt, channels = pygame.mixer.get_init()
+    return int(sound.get_length() * frequency * channels * abs(fmt) // 8)
+
+
+def tilemap_size(tilemap):
+    images = set(img for img in tilemap.images if img is not None)
+    size = sum(img.get_width() * img.get_height() * img.get_bytesize()
+               for img in images)
+    cells = tilemap.width * tilemap.height
+    return size + cells * 2 * len(list(tilemap.visible_layers))
+
 
 class Resources(object):
+    """Images, sounds and tilemaps listed in resources.ini.
+
+    Images are converted to the display format, with per-pixel alpha if
+    they have it, and can be packed into shared atlases.
+
+    Music is only located here; it is streamed by MusicPlayer.
 
-    def __init__(self):
+    Every tilemap is also a track: its compiled form, which has the map
+    properties without any XML to parse.
+
+    Each scene has a [scene:<name>] section in resources.ini listing the
+    resources it uses.  They are loaded when the scene is switched to, and
+    sounds and tilemaps not used by the current scene are evicted, least
+    recently used first, whenever their total size is over budget bytes.
+    """
+
+    EVICTABLE = ("sound", "tilemap")
+
+    def __init__(self, threads=4, cache_path=None, budget=64 * 1024 * 1024,
+                 frame_budget_ms=12.0):
         self.images = dict()
+        self.image_options = dict()
+        self.atlases = dict()
         self.sounds = dict()
         self.tilemaps = dict()
-        self.fonts = dict()
+        self.tracks = dict()
+        self.track_shapes = dict()
+        self.music = dict()
+        self.channel_groups = list()
+        self.voices = dict()
+        self.fonts = fonts
+        self.paths = dict()
+        self.order = list()
+        self.manifests = dict()
+        self.threads = threads
+        self.budget = budget
+        self.frame_budget = frame_budget_ms / 1000.0
+        self.sizes = OrderedDict()
+        self.pinned = set()
+        self.track_cache = None
+        self.cache_path = cache_path
+        if cache_path:
+            self.track_cache = TrackCache(cache_path)
         current_dir = os.path.dirname(os.path.realpath(__file__))
         self.path = os.path.join(current_dir, "resources")
         self.config_path = os.path.join(self.path, "resources.ini")
-        self.loaded = False
-
-    def load_images(self):
-        for key, path in self.images.items():
-            full_path = os.path.join(self.path, path)
-            img = pygame.image.load(full_path)
-            img.convert()
-            self.images[key] = img
-            logger.debug("Loaded image %s" % full_path)
-            yield "image", key
-
-    def load_sounds(self):
-        for key, path in self.sounds.items():
-            full_path = os.path.join(self.path, path)
-            self.sounds[key] = pygame.mixer.Sound(full_path)
-            logger.debug("Loaded sound %s" % full_path)
-            yield "sound", key
-
-    def load_tilemaps(self):
-        for key, path in self.tilemaps.items():
-            full_path = os.path.join(self.path, path)
-            self.tilemaps[key] = pytmx.load_pygame(full_path)
-            logger.debug("Loaded tilemap %s" % full_path)
-            yield "tilemap", key
-
-    def load_fonts(self):
-        yield None, None
+        self.loaded = dict(image=self.images, sound=self.sounds,
+                           tilemap=self.tilemaps, track=self.tracks)
+        self.decoders = {"image": decode_image,
+                         "sound": decode_sound,
+                         "tilemap": self.decode_tilemap,
+                         "track": self.decode_track}
+        self.finishers = {"image": self.finish_image,
+                          "sound": self.finish_sound,
+                          "tilemap": self.finish_tilemap,
+                          "track": self.finish_track}
+        self.load_config()
+
+    def decode_tilemap(self, path):
+        # Parse the XML, tile layers and collision shapes only; the
+        # tileset images are loaded when the map is finished on the main
+        # thread.
+        if self.track_cache is None:
+            return parse_track(path)
+        return self.track_cache.load(path)
+
+    def decode_track(self, path):
+        # Compile from the tilemap's parse, cached or not, rather than
+        # parsing the TMX file a second time.
+        return open_track(path, self.cache_path, self.decode_tilemap)
+
+    def finish_image(self, key, img):
+        options = self.image_options.get(key, dict())
+        alpha = options.get("alpha")
+        if alpha is None:
+            alpha = has_alpha(img)
+        if alpha:
+            img = img.convert_alpha()
+        else:
+            img = img.convert()
+        atlas_name = options.get("atlas")
+        if atlas_name is not None:
+            atlas = self.atlases.get(atlas_name)
+            if atlas is None:
+                atlas = self.atlases[atlas_name] = Atlas(atlas_name)
+            img = atlas.add(img)
+        self.images[key] = img
+
+    def finish_sound(self, key, sound):
+        self.sounds[key] = sound
+        self.sizes[("sound", key)] = sound_size(sound)
+
+    def finish_tilemap(self, key, track):
+        # The tileset images are the slow part, so they get a step of
+        # their own.
+        tilemap, shapes = track
+        tilemap.image_loader = pytmx.util_pygame.pygame_image_loader
+        tilemap.reload_images()
+        yield
+        self.tilemaps[key] = tilemap
+        self.track_shapes[key] = shapes
+        self.sizes[("tilemap", key)] = tilemap_size(tilemap)
+
+    def finish_track(self, key, track):
+        self.tracks[key] = track
 
     def load_config(self):
         parser = ConfigParser.SafeConfigParser()
         parser.read(self.config_path)
-        self.images.update(parser.items("images"))
-        self.sounds.update(parser.items("sounds"))
-        self.tilemaps.update(parser.items("tilemaps"))
-        self.fonts.update(parser.items("fonts"))
+        sections = (("image", "images"),
+                    ("sound", "sounds"),
+                    ("tilemap", "tilemaps"))
+        for category, section in sections:
+            for key, path in parser.items(section):
+                if category == "image":
+                    path = self.read_image_options(key, path)
+                self.paths[(category, key)] = path
+                self.order.append((category, key))
+        for group, count in parser.items("channel-groups"):
+            self.channel_groups.append((group, int(count)))
+        for key, value in parser.items("voices"):
+            group, priority, limit = [v.strip() for v in value.split(",")]
+            self.voices[key] = (group, int(priority), int(limit))
+        for key, path in parser.items("music"):
+            self.music[key] = os.path.join(self.path, path)
+        for key, path in parser.items("tilemaps"):
+            self.paths[("track", key)] = path
+            self.order.append(("track", key))
+        self.fonts.configure(parser.items("fonts"), self.path)
 
-    def load(self):
-        if self.loaded:
-            return
-        self.load_config()
-        dicts = (self.images, self.sounds, self.tilemaps, self.fonts)
-        total = sum(map(len, dicts))
+        for section in parser.sections():
+            if not section.startswith("scene:"):
+                continue
+            manifest = list()
+            for category, option in sections + (("track", "tracks"),):
+                if not parser.has_option(section, option):
+                    continue
+                keys = [k.strip() for k in
+                        parser.get(section, option).split(",")]
+                if "*" in keys:
+                    keys = [k for c, k in self.order if c == category]
+                manifest.extend((category, k) for k in keys if k)
+            self.manifests[section[len("scene:"):]] = manifest
+
+    def read_image_options(self, key, value):
+        """Split `file, option, ...` and return the file"""
+        parts = [part.strip() for part in value.split(",")]
+        options = dict()
+        for option in parts[1:]:
+            if option == "alpha":
+                options["alpha"] = True
+            elif option == "opaque":
+                options["alpha"] = False
+            elif option.startswith("atlas="):
+                options["atlas"] = option[len("atlas="):].strip()
+            else:
+                logger.warning("Unknown option %s for image %s"
+                               % (option, key))
+        self.image_options[key] = options
+        return parts[0]
+
+    def manifest(self, scene_name):
+        return list(self.manifests.get(scene_name, ()))
+
+    def is_loaded(self, category, key):
+        return key in self.loaded[category]
+
+    def touch(self, category, key):
+        size = self.sizes.pop((category, key), None)
+        if size is not None:
+            self.sizes[(category, key)] = size
+
+    def get(self, category, key):
+        """Return a resource, loading it on the main thread if needed"""
+        if not self.is_loaded(category, key):
+            full_path = os.path.join(self.path, self.paths[(category, key)])
+            value = self.decoders[category](full_path)
+            for step in self.finish(category, key, value):
+                pass
+            logger.debug("Loaded %s %s on demand" % (category, full_path))
+        self.touch(category, key)
+        return self.loaded[category][key]
+
+    def finish(self, category, key, value):
+        """Run a finisher, yielding between its steps if it has any"""
+        steps = self.finishers[category](key, value)
+        if steps is not None:
+            for step in steps:
+                yield
+
+    def weight(self, category, key):
+        # File size stands in for the time an item takes to load.
+        path = os.path.join(self.path, self.paths[(category, key)])
+        try:
+            return max(1, os.path.getsize(path))
+        except OSError:
+            return 1
+
+    def pin(self, items):
+        """Protect items, the current scene's resources, from eviction"""
+        self.pinned = set(items)
+
+    def require(self, items):
+        """Load whatever items are missing, then evict down to budget"""
+        self.pin(items)
+        for category, key in items:
+            self.get(category, key)
+        self.evict()
+
+    def evict(self):
+        total = sum(self.sizes.values())
+        for item in list(self.sizes):
+            if total <= self.budget:
+                break
+            category, key = item
+            if item in self.pinned:
+                continue
+            if category == "sound" and self.sounds[key].get_num_channels():
+                continue
+            total -= self.sizes.pop(item)
+            del self.loaded[category][key]
+            if category == "tilemap":
+                del self.track_shapes[key]
+            logger.debug("Evicted %s %s" % (category, key))
+        logger.debug("Resources using %d/%d bytes" % (total, self.budget))
+
+    def load(self, items=None, announce=True):
+        """Decode resources on a thread pool.
+
+        items defaults to everything in resources.ini; resources that are
+        already loaded are skipped.  This is a generator that is advanced
+        once per frame.  Whatever the pool has finished is converted here,
+        on the main thread, until frame_budget_ms of the frame is used,
+        and announced with a resources.loading message; resources.ini
+        order is kept so that the title image comes first.  Progress is
+        by file size, not item count.  Loading for a scene that isn't
+        running yet doesn't announce anything.
+        """
+        if items is None:
+            items = self.order
+        items = [item for item in items if not self.is_loaded(*item)]
+        weights = [self.weight(*item) for item in items]
+        total = float(max(1, sum(weights)))
         loaded = 0
         logger.debug(
             "Loading resources from config: %s" % str(self.config_path))
-        gens = (self.load_images, self.load_sounds, self.load_tilemaps,
-                self.load_fonts)
-
-        for gen in gens:
-            for category, key in gen():
-                loaded += 1
-                pub.sendMessage("resources.loading",
-                                percent=float(loaded) / float(total),
-                                category=category,
-                                key=key)
-                yield
-        self.loaded = True
-        pub.sendMessage("resources.loaded")
+
+        pool = ThreadPool(self.threads)
+        pending = list()
+        for category, key in items:
+            full_path = os.path.join(self.path, self.paths[(category, key)])
+            result = pool.apply_async(self.decoders[category], (full_path,))
+            pending.append((category, key, full_path, result))
+        pool.close()
+
+        budget = self.frame_budget
+        try:
+            frame_start = time.time()
+            for i, (category, key, full_path, result) in enumerate(pending):
+                while not result.ready():
+                    yield
+                    frame_start = time.time()
+                for step in self.finish(category, key, result.get()):
+                    if time.time() - frame_start >= budget:
+                        yield
+                        frame_start = time.time()
+                logger.debug("Loaded %s %s" % (category, full_path))
+                loaded += weights[i]
+                if announce:
+                    pub.sendMessage("resources.loading",
+                                    percent=loaded / total,
+                                    category=category,
+                                    key=key)
+                if time.time() - frame_start >= budget:
+                    yield
+                    frame_start = time.time()
+        finally:
+            pool.terminate()
+        self.evict()
+        if announce:
+            pub.sendMessage("resources.loaded")
 
 
 class Game(object):
@@ -115,7 +370,47 @@ class Game(object):
             self.display_height = 480
 
         self.display_size = (self.display_width, self.display_height)
+
+        try:
+            render_width = int(config.get("render_width", 640))
+        except ValueError:
+            logger.warning("Invalid RENDER_WIDTH")
+            render_width = 640
+
+        try:
+            render_height = int(config.get("render_height", 480))
+        except ValueError:
+            logger.warning("Invalid RENDER_HEIGHT")
+            render_height = 480
+
+        self.render_size = (render_width, render_height)
+        self.render_scale = config.get("render_scale", "integer")
+        if self.render_scale not in SCALE_MODES:
+            logger.warning("Invalid RENDER_SCALE")
+            self.render_scale = "integer"
+        self.sound_enabled = int(config.get("sound_enabled", 0))
+        self.music = MusicPlayer(resources.music,
+                                 int(config.get("music_crossfade_ms", 1000)))
+        self.voices = VoiceManager(resources.channel_groups,
+                                   resources.voices)
+
+        profile_frames = int(config.get("profile_frames", 0))
+        if profile_frames > 0:
+            self.profiler = FrameProfiler(profile_frames)
+            self.profiler.show_overlay = bool(
+                int(config.get("profile_overlay", 0)))
+            for scene in scenes.values():
+                scene.profiler = self.profiler
+            inputs.subscribe(self.on_profiler_key, "input.key-up")
+        else:
+            self.profiler = NULL_PROFILER
+
+        inputs.subscribe(self.on_quit, "input.quit")
+        inputs.subscribe(self.on_show_fps, "game.show-fps")
         pub.subscribe(self.switch_scene, "game.switch-scene")
+        pub.subscribe(self.prefetch_scene, "game.prefetch-scene")
+        self.prefetching = None
+        self.pending_switch = None
         pub.subscribe(self.play_sound, "game.play-sound")
         pub.subscribe(self.stop_sound, "game.stop-sound")
 
@@ -124,27 +419,89 @@ class Game(object):
         pygame.display.init()
         pygame.font.init()
         pygame.mixer.init()
-        screen = pygame.display.set_mode(self.display_size)
+        self.voices.init()
+        screen = display.init(self.display_size, self.render_size,
+                              self.render_scale)
         pygame.display.set_caption(GAMETITLE)
         return screen
 
+    def prefetch_scene(self, name, options=None):
+        """Start loading and preparing a scene that will be switched to"""
+        if options is not None:
+            options = dict(options)
+        logger.debug("Prefetching scene %s" % name)
+        self.prefetching = (name, options, self._prefetch(name, options))
+        self.pending_switch = None
+
+    def _prefetch(self, name, options):
+        scene = self.scenes[name]
+        items = (self.resources.manifest(name)
+                 + scene.get_resources(options))
+        # Keep both scenes' resources while they overlap.
+        self.resources.pin(self.resources.pinned | set(items))
+        for step in self.resources.load(items, announce=False):
+            yield
+        for step in scene.prepare(options):
+            yield
+
+    def step_prefetch(self):
+        name, options, steps = self.prefetching
+        try:
+            next(steps)
+        except StopIteration:
+            logger.debug("Prefetched scene %s" % name)
+            self.prefetching = None
+            if self.pending_switch is not None:
+                self.switch_scene(*self.pending_switch)
+
     def switch_scene(self, name, options):
+        if self.prefetching is not None:
+            if self.prefetching[0] == name:
+                # Switch once the scene is ready.
+                self.pending_switch = (name, options)
+                return
+            self.prefetching = None
+        self.pending_switch = None
         self.current_scene.teardown()
+        subscriptions.release()
+        if logger.isEnabledFor(logging.DEBUG):
+            subscriptions.report()
         self.current_scene = self.scenes[name]
+        if options is not None:
+            options = dict(options)
+        self.resources.require(
+            self.resources.manifest(name)
+            + self.current_scene.get_resources(options))
         if options is None:
             self.current_scene.setup()
         else:
-            self.current_scene.setup(dict(options))
+            self.current_scene.setup(options)
 
     def play_sound(self, name=None, loops=0, maxtime=0, fade_ms=0):
-        if int(self.config.get("sound_enabled", 0)):
-            self.resources.sounds[name].play(loops, maxtime, fade_ms)
+        if not self.sound_enabled:
+            return
+        if name in self.music:
+            self.music.play(name, loops, fade_ms or None)
+        else:
+            sound = self.resources.get("sound", name)
+            self.voices.play(name, sound, loops, maxtime, fade_ms)
 
     def stop_sound(self, name=None, fade_ms=0):
-        if fade_ms == 0:
-            self.resources.sounds[name].stop()
+        if name in self.music:
+            self.music.stop(name, fade_ms)
         else:
-            self.resources.sounds[name].fadeout(fade_ms)
+            self.voices.stop(name, fade_ms)
+
+    def on_profiler_key(self, key, mod):
+        if key == pygame.K_F11:
+            self.profiler.show_overlay = not self.profiler.show_overlay
+            # Scenes that only redraw what changed would keep the graph.
+            compositor = getattr(self.current_scene, "compositor", None)
+            if compositor is not None:
+                compositor.invalidate()
+        elif key == pygame.K_F12:
+            path = time.strftime("platakart-frames-%Y%m%d-%H%M%S.json")
+            self.profiler.dump(path)
 
     def main_loop(self):
         screen = self.init_pygame()
@@ -157,52 +514,55 @@ class Game(object):
         logger.debug("Shutting down main loop")
         pygame.quit()
 
+    def start(self):
+        self.resources.pin(
+            self.resources.manifest(self.current_scene.get_name()))
+        self.current_scene.setup()
+
+    def dispatch_events(self, events):
+        inputs.dispatch(events)
+
+    def on_quit(self):
+        self.shutting_down = True
+
+    def on_show_fps(self):
+        logger.debug("FPS: %d" % self.clock.get_fps())
+        logger.debug("Text cache: %(hits)d hits, %(misses)d misses, "
+                     "%(size)d surfaces" % fonts.stats())
+        logger.debug("Input dispatch: %(events)d events, %(calls)d calls, "
+                     "%(coalesced)d motions coalesced, %(ms).3f ms"
+                     % inputs.stats())
+        logger.debug("Voices: %(active)r active, %(stolen)d stolen, "
+                     "%(dropped)d dropped" % self.voices.stats())
+
     def _main_loop(self, screen):
         # Get references to things that will be used in every frame to
         # avoid needless derefrencing.
         target_fps = float(self.config.get("target_fps", 30))
         pump = pygame.event.pump
         get = pygame.event.get
-        QUIT = pygame.QUIT
-        MOUSEMOTION = pygame.MOUSEMOTION
-        MOUSEBUTTONDOWN = pygame.MOUSEBUTTONDOWN
-        MOUSEBUTTONUP = pygame.MOUSEBUTTONUP
-        KEYDOWN = pygame.KEYDOWN
-        KEYUP = pygame.KEYUP
+        dispatch_events = self.dispatch_events
+        tick = self.clock.tick
+        profiler = self.profiler
+        music = self.music
         pygame.time.set_timer(SHOWFPSEVENT, 3000)
-        self.current_scene.setup()
+        self.start()
         while not self.shutting_down:
+            profiler.begin_frame()
             pump()
-            for event in get():
-                t = event.type
-                if t == QUIT:
-                    self.shutting_down = True
-                    break
-                elif t == SHOWFPSEVENT:
-                    logger.debug("FPS: %d" % self.clock.get_fps())
-                elif t == MOUSEMOTION:
-                    pub.sendMessage("input.mouse-move", pos=event.pos,
-                                    rel=event.rel, buttons=event.buttons)
-                elif t == MOUSEBUTTONDOWN:
-                    pub.sendMessage("input.mouse-down", pos=event.pos,
-                                    button=event.button)
-                elif t == MOUSEBUTTONUP:
-                    pub.sendMessage("input.mouse-up", pos=event.pos,
-                                    button=event.button)
-                elif t == KEYUP:
-                    pub.sendMessage(
-                        "input.key-up",
-                        key=event.key,
-                        mod=event.mod)
-                elif t == KEYDOWN:
-                    pub.sendMessage(
-                        "input.key-down",
-                        unicode=event.unicode,
-                        key=event.key,
-                        mod=event.mod)
-
-            delta = self.clock.tick(target_fps)
+            dispatch_events(get())
+            profiler.mark("events")
+            delta = tick(target_fps)
+            profiler.skip()
+            music.update(delta)
             self.current_scene.update(screen, delta)
+            profiler.mark("update")
+            if self.prefetching is not None:
+                self.step_prefetch()
+                profiler.mark("load")
+            profiler.end_frame()
+            if profiler.enabled and profiler.show_overlay:
+                display.update(profiler.draw(screen))
 
 
 def parse_config(config_path):
@@ -227,7 +587,13 @@ def create_game(config_path):
     else:
         conf = parse_config(config_path)
 
-    resources = Resources()
+    cache_path = conf.get("track_cache_dir")
+    if cache_path is None:
+        cache_path = os.path.join("~", ".platakart", "cache")
+    cache_path = os.path.expanduser(cache_path)
+    budget = int(float(conf.get("resource_budget_mb", 64)) * 1024 * 1024)
+    resources = Resources(int(conf.get("loader_threads", 4)), cache_path,
+                          budget, float(conf.get("load_budget_ms", 12)))
     scenes = {"title": TitleScene(resources),
               "kart-select": KartSelectScene(resources),
               "track-select": TrackSelectScene(resources),
@@ -0,0 +1,184 @@
+# -*- coding: utf-8; -*-
+
+import logging
+import time
+import weakref
+
+from pubsub import pub
+import pygame
+
+logger = logging.getLogger("platakart.dispatch")
+
+# Input topics: the event type each one is sent for and the arguments,
+# in order, that its listeners are called with.
+INPUT_TOPICS = (
+    ("input.quit", pygame.QUIT, lambda e: ()),
+    ("input.mouse-move", pygame.MOUSEMOTION,
+     lambda e: (e.pos, e.rel, e.buttons)),
+    ("input.mouse-down", pygame.MOUSEBUTTONDOWN,
+     lambda e: (e.pos, e.button)),
+    ("input.mouse-up", pygame.MOUSEBUTTONUP,
+     lambda e: (e.pos, e.button)),
+    ("input.key-down", pygame.KEYDOWN,
+     lambda e: (e.unicode, e.key, e.mod)),
+    ("input.key-up", pygame.KEYUP,
+     lambda e: (e.key, e.mod)),
+)
+MOUSE_BUTTONS = (pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP)
+
+
+def make_ref(listener):
+    # Like pubsub, don't keep objects alive just because they listen.
+    obj = getattr(listener, "__self__", None)
+    if obj is None:
+        return None, listener
+    return weakref.ref(obj), listener.__func__
+
+
+class InputDispatcher(object):
+    """Sends pygame input events straight to their listeners.
+
+    This replaces pubsub for input, which is sent many times a frame:
+    listeners are kept in a table per event type and called with
+    positional arguments.  Mouse motion is coalesced so listeners get at
+    most one input.mouse-move per dispatch, after the other events.
+    map_pos, when set, converts mouse positions from window to screen
+    coordinates.
+    """
+
+    def __init__(self):
+        self.topics = dict()
+        self.args = dict()
+        self.listeners = dict()
+        self.events = 0
+        self.calls = 0
+        self.coalesced = 0
+        self.elapsed = 0.0
+        self.map_pos = None
+        for topic, event_type, args in INPUT_TOPICS:
+            self.add_topic(topic, event_type, args)
+
+    def add_topic(self, topic, event_type, args):
+        self.topics[topic] = event_type
+        self.args[event_type] = args
+        self.listeners.setdefault(event_type, ())
+
+    def subscribe(self, listener, topic):
+        event_type = self.topics[topic]
+        self.listeners[event_type] += (make_ref(listener),)
+
+    def unsubscribe(self, listener, topic):
+        event_type = self.topics[topic]
+        ref = make_ref(listener)
+        self.listeners[event_type] = tuple(
+            l for l in self.listeners[event_type] if l != ref)
+
+    def dispatch(self, events):
+        start = time.time()
+        MOUSEMOTION = pygame.MOUSEMOTION
+        map_pos = self.map_pos
+        motion = None
+        rel_x = rel_y = 0
+        for event in events:
+            t = event.type
+            if t == MOUSEMOTION:
+                if motion is not None:
+                    self.coalesced += 1
+                motion = event
+                rel_x += event.rel[0]
+                rel_y += event.rel[1]
+            elif t in self.args:
+                args = self.args[t](event)
+                if map_pos is not None and t in MOUSE_BUTTONS:
+                    args = (map_pos(args[0]),) + args[1:]
+                self.send(t, args)
+            self.events += 1
+
+        if motion is not None:
+            pos = motion.pos
+            if map_pos is not None:
+                pos = map_pos(pos)
+            self.send(MOUSEMOTION, (pos, (rel_x, rel_y), motion.buttons))
+        self.elapsed += time.time() - start
+
+    def send(self, event_type, args):
+        dead = False
+        for ref, func in self.listeners[event_type]:
+            if ref is None:
+                func(*args)
+            else:
+                obj = ref()
+                if obj is None:
+                    dead = True
+                    continue
+                func(obj, *args)
+            self.calls += 1
+        if dead:
+            self.listeners[event_type] = tuple(
+                (ref, func) for ref, func in self.listeners[event_type]
+                if ref is None or ref() is not None)
+
+    def listener_counts(self):
+        return dict((topic, len(self.listeners[event_type]))
+                    for topic, event_type in self.topics.items())
+
+    def stats(self):
+        """Dispatch counters since the last call, reset on each call"""
+        result = {"events": self.events,
+                  "calls": self.calls,
+                  "coalesced": self.coalesced,
+                  "ms": self.elapsed * 1000.0}
+        self.events = self.calls = self.coalesced = 0
+        self.elapsed = 0.0
+        return result
+
+
+inputs = InputDispatcher()
+
+
+class SubscriptionScope(object):
+    """Subscriptions made by the running scene and its widgets.
+
+    Input topics go to the InputDispatcher and everything else to pubsub.
+    Game releases the scope when the scene is torn down, so widgets don't
+    need to unsubscribe themselves.
+    """
+
+    def __init__(self):
+        self.active = list()
+        self.topics = set()
+
+    def subscribe(self, listener, topic):
+        if topic in inputs.topics:
+            inputs.subscribe(listener, topic)
+        else:
+            pub.subscribe(listener, topic)
+        self.active.append((listener, topic))
+        self.topics.add(topic)
+
+    def release(self):
+        for listener, topic in self.active:
+            if topic in inputs.topics:
+                inputs.unsubscribe(listener, topic)
+            else:
+                pub.unsubscribe(listener, topic)
+        logger.debug("Released %d subscriptions" % len(self.active))
+        self.active = list()
+
+    def listener_counts(self):
+        """Listeners per topic, for every topic the scope has used"""
+        counts = inputs.listener_counts()
+        topic_mgr = pub.getDefaultTopicMgr()
+        for name in self.topics:
+            if name not in counts:
+                topic = topic_mgr.getTopic(name, okIfNone=True)
+                counts[name] = topic.getNumListeners() if topic else 0
+        return counts
+
+    def report(self):
+        counts = self.listener_counts()
+        for topic in sorted(counts):
+            logger.debug("%4d listeners on %s" % (counts[topic], topic))
+
+
+subscriptions = SubscriptionScope()
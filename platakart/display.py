@@ -0,0 +1,115 @@
+# -*- coding: utf-8; -*-
+
+import logging
+
+import pygame
+import pygame.display
+import pygame.transform
+
+from platakart.dispatch import inputs
+
+logger = logging.getLogger("platakart.display")
+
+SCALE_MODES = ("integer", "fit", "smooth", "sdl")
+
+
+def fit_rect(size, window_size, integer=True):
+    """Largest rect with size's aspect ratio centred in window_size.
+
+    With integer, the scale is a whole number whenever the window is at
+    least as big as size, so every pixel is drawn the same size.
+    """
+    width, height = size
+    window_width, window_height = window_size
+    scale = min(window_width / float(width), window_height / float(height))
+    if integer and scale >= 1:
+        scale = int(scale)
+    rect = pygame.Rect(0, 0, int(width * scale), int(height * scale))
+    rect.center = (window_width // 2, window_height // 2)
+    return rect
+
+
+class Display(object):
+    """The window and the surface the scenes draw on.
+
+    Scenes draw at render_size whatever the size of the window.  When
+    the two differ, each presented frame is scaled into the window by a
+    single pygame.transform call, straight into the window surface,
+    and mouse positions are mapped back to render coordinates.  The
+    "sdl" mode leaves the scaling to SDL where pygame has
+    pygame.SCALED.
+    """
+
+    def __init__(self):
+        self.window = None
+        self.screen = None
+        self.render_size = (640, 480)
+        self.scaled = False
+        self.target = None
+        self.target_surf = None
+        self.smooth = False
+
+    def init(self, window_size, render_size=None, mode="integer"):
+        render_size = tuple(render_size or window_size)
+        window_size = tuple(window_size)
+        self.render_size = render_size
+        self.scaled = False
+        inputs.map_pos = None
+
+        scaled_flag = getattr(pygame, "SCALED", None)
+        if mode == "sdl" and scaled_flag is None:
+            logger.warning("SDL scaling needs pygame 2, scaling to fit")
+            mode = "fit"
+
+        if render_size == window_size:
+            self.window = self.screen = pygame.display.set_mode(window_size)
+        elif mode == "sdl":
+            self.window = self.screen = pygame.display.set_mode(
+                render_size, scaled_flag)
+        else:
+            self.window = pygame.display.set_mode(window_size)
+            self.window.fill((0, 0, 0))
+            self.screen = pygame.Surface(render_size, 0, self.window)
+            self.target = fit_rect(render_size, window_size,
+                                   mode == "integer")
+            self.target_surf = self.window.subsurface(self.target)
+            self.smooth = (mode == "smooth"
+                           and self.window.get_bitsize() >= 24)
+            self.scaled = True
+            inputs.map_pos = self.to_render
+            logger.debug("Scaling %dx%d frames to %dx%d"
+                         % (render_size + self.target.size))
+        return self.screen
+
+    def to_render(self, pos):
+        target = self.target
+        width, height = self.render_size
+        return ((pos[0] - target.x) * width // target.width,
+                (pos[1] - target.y) * height // target.height)
+
+    def present(self):
+        if self.smooth:
+            pygame.transform.smoothscale(self.screen, self.target.size,
+                                         self.target_surf)
+        else:
+            pygame.transform.scale(self.screen, self.target.size,
+                                   self.target_surf)
+
+    def flip(self):
+        if self.scaled:
+            self.present()
+        pygame.display.flip()
+
+    def update(self, rects=None):
+        """Show the given parts of the frame, or all of it"""
+        if not self.scaled:
+            if rects is None:
+                pygame.display.update()
+            else:
+                pygame.display.update(rects)
+        elif rects is None or rects:
+            self.present()
+            pygame.display.update(self.target)
+
+
+display = Display()
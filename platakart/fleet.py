@@ -0,0 +1,107 @@
+# -*- coding: utf-8; -*-
+
+import logging
+
+import numpy
+
+logger = logging.getLogger("platakart.fleet")
+
+
+class KartFleet(object):
+    """Control and render state of every kart on a track, in arrays.
+
+    Motor rates, directions and performance values are held in
+    contiguous arrays so accelerate and decelerate update all of the
+    selected karts at once.  Rates are written to the pymunk motors by
+    apply, before the space is stepped, and only where they changed.
+    Body positions and angles are read back in one pass per step.
+    """
+
+    def __init__(self, karts):
+        self.karts = karts
+        count = len(karts)
+        self.count = count
+        self.max_motor_rate = numpy.array(
+            [k.perf.max_motor_rate for k in karts], dtype=float)
+        self.acceleration_rate = numpy.array(
+            [k.perf.acceleration_rate for k in karts], dtype=float)
+        self.break_rate = numpy.array(
+            [k.perf.break_rate for k in karts], dtype=float)
+        self.direction = numpy.array([k.direction for k in karts],
+                                     dtype=float)
+
+        # Every kart has the same number of motors, and the chassis
+        # followed by the wheels as bodies.
+        self.motors = [m for k in karts for m in k.motors]
+        self.motor_rates = numpy.array(
+            [m.rate for m in self.motors], dtype=float).reshape(count, -1)
+        self.written_rates = self.motor_rates.copy()
+        self.bodies = [b for k in karts for b in [k.chassis] + k.wheels]
+        self.bodies_per_kart = len(self.bodies) // max(1, count)
+        self.state = numpy.zeros((len(self.bodies), 3))
+        self.previous_state = None
+        self.read_state()
+
+    def select(self, karts=None):
+        if karts is None:
+            return slice(None)
+        return numpy.asarray(karts)
+
+    def accelerate(self, direction, karts=None):
+        """Speed up the motors of the given kart indexes, or all karts"""
+        which = self.select(karts)
+        rates = self.motor_rates[which]
+        amt = (direction * self.acceleration_rate[which])[:, None]
+        accelerated = rates + amt
+        ok = numpy.abs(accelerated) < self.max_motor_rate[which][:, None]
+        self.motor_rates[which] = numpy.where(ok, accelerated, rates)
+
+    def decelerate(self, karts=None):
+        which = self.select(karts)
+        direction = self.direction[which][:, None]
+        rates = (self.motor_rates[which]
+                 - direction * self.break_rate[which][:, None])
+        # Braking stops the motors, it never reverses them.
+        past_zero = rates * direction < 0
+        rates[past_zero] = 0
+        self.motor_rates[which] = rates
+
+    def jump(self, karts=None):
+        if karts is None:
+            karts = range(self.count)
+        for i in karts:
+            self.karts[i].jump()
+
+    def apply(self):
+        changed = numpy.flatnonzero(self.motor_rates != self.written_rates)
+        if len(changed):
+            rates = self.motor_rates.ravel().tolist()
+            motors = self.motors
+            for i in changed.tolist():
+                motors[i].rate = rates[i]
+            self.written_rates[:] = self.motor_rates
+
+    def read_state(self):
+        self.state[:] = [(b.position.x, b.position.y, b.angle)
+                         for b in self.bodies]
+        return self.state
+
+    def store_state(self):
+        self.previous_state = self.state.copy()
+
+    def interpolate(self, alpha):
+        """Give every kart its drawn state, blended from the last two"""
+        self.read_state()
+        if self.previous_state is None:
+            blended = self.state
+        else:
+            blended = (self.previous_state
+                       + (self.state - self.previous_state) * alpha)
+        rows = blended.tolist()
+        n = self.bodies_per_kart
+        for i, kart in enumerate(self.karts):
+            kart.render_state = rows[i * n:(i + 1) * n]
+
+    def positions(self):
+        """Chassis positions of all karts as an (n, 2) array"""
+        return self.state[::self.bodies_per_kart, :2]
@@ -0,0 +1,68 @@
+# -*- coding: utf-8; -*-
+
+from collections import OrderedDict
+import logging
+import os.path
+
+import pygame.font
+
+logger = logging.getLogger("platakart.fonts")
+
+
+class FontRegistry(object):
+    """Fonts named in the [fonts] section of resources.ini.
+
+    Each font is resolved once, on first use, and shared from then on.
+    render keeps the most recently rendered text surfaces, which must not
+    be drawn on, so text that is drawn again isn't rendered again.
+    """
+
+    def __init__(self, cache_size=256):
+        self.specs = dict()
+        self.fonts = dict()
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, items, path):
+        """Read `name = family or file, size` entries"""
+        for name, value in items:
+            source, size = [part.strip() for part in value.rsplit(",", 1)]
+            full_path = os.path.join(path, source)
+            if os.path.isfile(full_path):
+                source = full_path
+            self.specs[name] = (source, int(size))
+
+    def get(self, name):
+        font = self.fonts.get(name)
+        if font is None:
+            source, size = self.specs[name]
+            if os.path.isfile(source):
+                font = pygame.font.Font(source, size)
+            else:
+                font = pygame.font.SysFont(source, size)
+            logger.debug("Resolved font %s to %s %d" % (name, source, size))
+            self.fonts[name] = font
+        return font
+
+    def render(self, font, text, color, antialias=True):
+        key = (font, text, tuple(color), antialias)
+        surf = self.cache.pop(key, None)
+        if surf is None:
+            self.misses += 1
+            surf = font.render(text, antialias, color)
+            if len(self.cache) >= self.cache_size:
+                self.cache.popitem(last=False)
+        else:
+            self.hits += 1
+        self.cache[key] = surf
+        return surf
+
+    def stats(self):
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "size": len(self.cache)}
+
+
+fonts = FontRegistry()
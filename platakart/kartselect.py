@@ -8,7 +8,10 @@ import pygame.sprite
 
 logger = logging.getLogger("platakart.kartselect")
 
+from platakart.dispatch import subscriptions
+from platakart.display import display
 from platakart.ui import Button
+from platakart.ui import Compositor
 from platakart.ui import Scene
 from platakart.ui import WHITE
 from platakart.ui import BLACK
@@ -30,9 +33,10 @@ class KartSelectScene(Scene):
 
     def setup(self, kwargs=None):
         self.rendered = False
+        self.fading_out = -0.1
         logger.debug("Setting up kart select scene")
-        self.font = pygame.font.SysFont("Verdana", 32)
-        self.buttons = pygame.sprite.RenderUpdates()
+        self.font = self.resources.fonts.get("menu")
+        self.buttons = Compositor(self.resources.images["kart-select"])
         self.buttons.add(Button("veloc", "Velocity", self.font,
                                 (400, 50),
                                 self.resources.images["red_button_up"],
@@ -47,20 +51,16 @@ class KartSelectScene(Scene):
                                 (400, 380),
                                 self.resources.images["red_button_up"],
                                 self.resources.images["red_button_down"]))
-        pub.subscribe(self.on_button_clicked, "button.clicked")
+        subscriptions.subscribe(self.on_button_clicked, "button.clicked")
 
 
     def teardown(self):
         logger.debug("Tearing down kart select scene")
         self.buttons = None
         self.font = None
-        pub.unsubscribe(self.on_button_clicked, "button.clicked")
 
     def update(self, screen, delta):
         if not self.rendered:
-            screen_rect = screen.get_rect()
-            screen.blit(self.resources.images["kart-select"], screen_rect)
-            pygame.display.flip()
             pub.sendMessage(
                 "game.play-sound", name="kart-select", loops=-1)
             self.rendered = True
@@ -74,13 +74,14 @@ class KartSelectScene(Scene):
             amt = fade_rect.height * float(self.fading_out) / 100.0
             fade_rect.height = int(amt)
             pygame.draw.rect(screen, FADE_COLOR, fade_rect)
-            pygame.display.update(fade_rect)
+            display.update(fade_rect)
         else:
             self.buttons.update()
-            rects = self.buttons.draw(screen)
-            pygame.display.update(rects)
+            self.buttons.present(screen)
 
     def on_button_clicked(self, id):
         logger.debug("Kart {%s} selected" % id)
         self.fading_out = 0.0
         self.selected_kart_id = id
+        pub.sendMessage("game.prefetch-scene", name="track-select",
+                        options=[("kart_id", id)])
@@ -0,0 +1,117 @@
+# -*- coding: utf-8; -*-
+
+import logging
+
+import pygame
+import pygame.draw
+import pygame.transform
+import pytmx
+
+logger = logging.getLogger("platakart.minimap")
+
+from platakart.collision import world_vertices
+from platakart.ui import BLUE
+from platakart.ui import RED
+from platakart.ui import WHITE
+
+DEFAULT_SCALE = .075
+KART_COLOR = RED
+CHECKPOINT_COLOR = BLUE
+SHAPE_COLOR = WHITE
+MARKER_RADIUS = 3
+
+
+class MiniMap(object):
+    """Low resolution track overview.
+
+    The tile layers and static collision shapes, as extract_shapes
+    describes them, are rendered once, when the mini-map is built.  Each
+    refresh only copies that surface and draws the kart and checkpoint
+    markers over it.  With a refresh_interval (in ms) the markers are
+    redrawn at most that often.
+    """
+
+    def __init__(self, tmx_data, bodies, scale=DEFAULT_SCALE,
+                 refresh_interval=0):
+        self.scale = scale
+        self.refresh_interval = refresh_interval
+        self.elapsed = 0
+        self.map_height = tmx_data.tileheight * tmx_data.height
+        size = (int(tmx_data.tilewidth * tmx_data.width * scale),
+                int(self.map_height * scale))
+        self.static_surf = pygame.Surface(size)
+        self.surf = pygame.Surface(size)
+        self.rect = self.surf.get_rect()
+        self.checkpoints = list()
+        self.dirty = True
+        self._render_tiles(tmx_data)
+        self._render_shapes(bodies)
+        logger.debug("Rendered %dx%d mini-map" % size)
+
+    def to_mini_map(self, pos):
+        x, y = pos
+        return (int(x * self.scale), int((self.map_height - y) * self.scale))
+
+    def _render_tiles(self, tmx_data):
+        bg = getattr(tmx_data, "background_color", None)
+        if bg:
+            self.static_surf.fill(pygame.Color(bg))
+
+        tw = tmx_data.tilewidth * self.scale
+        th = tmx_data.tileheight * self.scale
+        # Each tile runs from its own edge to the next tile's, so tiles
+        # meet with no gaps; the sizes differ by a pixel at most.
+        scaled = dict()
+        blit = self.static_surf.blit
+        for layer in tmx_data.visible_layers:
+            if not isinstance(layer, pytmx.TiledTileLayer):
+                continue
+            for x, y, image in layer.tiles():
+                left, top = int(x * tw), int(y * th)
+                size = (max(1, int((x + 1) * tw) - left),
+                        max(1, int((y + 1) * th) - top))
+                mini = scaled.get((image, size))
+                if mini is None:
+                    mini = pygame.transform.scale(image, size)
+                    scaled[(image, size)] = mini
+                blit(mini, (left, top))
+
+    def _render_shapes(self, bodies):
+        for (mass, position, angle), shapes in bodies:
+            if mass is not None:
+                continue
+            for geometry, attrs in shapes:
+                kind = geometry[0]
+                if kind == "poly":
+                    verts = world_vertices(position, angle, geometry[1])
+                    points = [self.to_mini_map(v) for v in verts]
+                    pygame.draw.lines(self.static_surf, SHAPE_COLOR, True,
+                                      points)
+                elif kind == "segment":
+                    a, b = world_vertices(position, angle, geometry[1:3])
+                    pygame.draw.line(self.static_surf, SHAPE_COLOR,
+                                     self.to_mini_map(a),
+                                     self.to_mini_map(b))
+
+    def set_checkpoints(self, positions):
+        self.checkpoints = list(positions)
+        self.dirty = True
+
+    def update(self, delta, karts):
+        self.elapsed += delta
+        if not self.dirty and self.elapsed < self.refresh_interval:
+            return
+        self.elapsed = 0
+        self.dirty = False
+        surf = self.surf
+        surf.blit(self.static_surf, (0, 0))
+        for pos in self.checkpoints:
+            pygame.draw.circle(surf, CHECKPOINT_COLOR,
+                               self.to_mini_map(pos), MARKER_RADIUS, 1)
+        for kart in karts:
+            pygame.draw.circle(surf, KART_COLOR,
+                               self.to_mini_map(kart.chassis.position),
+                               MARKER_RADIUS)
+
+    def draw(self, screen, pos=(0, 0)):
+        return screen.blit(self.surf, pos)
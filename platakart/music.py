@@ -0,0 +1,89 @@
+# -*- coding: utf-8; -*-
+
+import logging
+
+import pygame.mixer
+
+logger = logging.getLogger("platakart.music")
+
+
+class MusicPlayer(object):
+    """Streams the [music] entries of resources.ini with pygame.mixer.music.
+
+    Music is decoded as it plays instead of being loaded into a Sound.
+    There is only one music stream, so switching tracks fades the
+    current one out and the new one in, over crossfade_ms in all.  Fades
+    are volume ramps advanced by update, once a frame, because
+    pygame.mixer.music.fadeout blocks until it is done.
+    """
+
+    def __init__(self, paths, crossfade_ms=1000):
+        self.paths = paths
+        self.crossfade_ms = crossfade_ms
+        self.current = None
+        self.pending = None
+        self.volume = 0.0
+        self.target = 0.0
+        self.rate = 0.0
+
+    def __contains__(self, name):
+        return name in self.paths
+
+    def fade_to(self, target, fade_ms):
+        self.target = target
+        if fade_ms <= 0:
+            self.volume = target
+            self.rate = 0.0
+        else:
+            self.rate = 1.0 / fade_ms
+
+    def play(self, name, loops=-1, fade_ms=None):
+        """Switch to name, fading out whatever is playing first"""
+        if fade_ms is None:
+            fade_ms = self.crossfade_ms
+        if (name == self.current and self.pending is None
+                and pygame.mixer.music.get_busy()):
+            self.fade_to(1.0, fade_ms // 2)
+            return
+        self.pending = (name, loops, fade_ms // 2)
+        if self.current is not None:
+            self.fade_to(0.0, fade_ms // 2)
+
+    def queue(self, name):
+        """Play name once the current music ends"""
+        pygame.mixer.music.queue(self.paths[name])
+
+    def stop(self, name=None, fade_ms=0):
+        if name is not None and name != self.current:
+            if self.pending is not None and self.pending[0] == name:
+                self.pending = None
+            return
+        self.pending = None
+        self.fade_to(0.0, fade_ms)
+        self.update(0)
+
+    def start_pending(self):
+        name, loops, fade_ms = self.pending
+        self.pending = None
+        logger.debug("Streaming music %s" % name)
+        pygame.mixer.music.load(self.paths[name])
+        pygame.mixer.music.set_volume(0.0)
+        pygame.mixer.music.play(loops)
+        self.current = name
+        self.volume = 0.0
+        self.fade_to(1.0, fade_ms)
+
+    def update(self, delta):
+        if self.volume < self.target:
+            self.volume = min(self.target, self.volume + self.rate * delta)
+        elif self.volume > self.target:
+            self.volume = max(self.target, self.volume - self.rate * delta)
+
+        if (self.current is not None and self.target <= 0.0
+                and self.volume <= 0.0):
+            pygame.mixer.music.stop()
+            self.current = None
+        if self.pending is not None and self.current is None:
+            self.start_pending()
+        if self.current is not None:
+            pygame.mixer.music.set_volume(self.volume)
@@ -0,0 +1,119 @@
+# -*- coding: utf-8; -*-
+
+from array import array
+import json
+import logging
+import time
+
+import pygame
+import pygame.draw
+
+logger = logging.getLogger("platakart.profiler")
+
+PHASES = ("events", "physics", "tiles", "sprites", "mini-map", "flip",
+          "update", "load")
+PHASE_COLORS = ((255, 255, 255), (255, 0, 0), (0, 160, 0), (0, 0, 255),
+                (255, 255, 0), (255, 0, 255), (0, 255, 255), (255, 128, 0))
+GRAPH_SIZE = (300, 100)
+GRAPH_MS = 50.0
+
+
+class NullProfiler(object):
+    """Stands in for FrameProfiler when profiling is off"""
+
+    enabled = False
+
+    def begin_frame(self):
+        pass
+
+    def mark(self, phase):
+        pass
+
+    def skip(self):
+        pass
+
+    def end_frame(self):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class FrameProfiler(object):
+    """Times the phases of the last `size` frames.
+
+    A frame is timed by calling mark(phase) at the end of each phase;
+    the time since the previous mark (or skip, or begin_frame) is added to
+    that phase.  Timings are kept in ms in one ring buffer per phase.
+    """
+
+    enabled = True
+
+    def __init__(self, size=300):
+        self.size = size
+        self.index = 0
+        self.count = 0
+        self.indexes = dict((name, i) for i, name in enumerate(PHASES))
+        self.buffers = [array("d", [0.0] * size) for name in PHASES]
+        self.current = [0.0] * len(PHASES)
+        self.last = 0.0
+        self.show_overlay = False
+        self.graph = None
+
+    def begin_frame(self):
+        self.current = [0.0] * len(PHASES)
+        self.last = time.time()
+
+    def mark(self, phase):
+        now = time.time()
+        self.current[self.indexes[phase]] += (now - self.last) * 1000.0
+        self.last = now
+
+    def skip(self):
+        self.last = time.time()
+
+    def end_frame(self):
+        index = self.index
+        for buff, value in zip(self.buffers, self.current):
+            buff[index] = value
+        self.index = (index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def frames(self):
+        """Per frame phase timings, oldest first"""
+        start = (self.index - self.count) % self.size
+        indexes = [(start + i) % self.size for i in range(self.count)]
+        return [[buff[i] for buff in self.buffers] for i in indexes]
+
+    def dump(self, path):
+        frames = self.frames()
+        count = float(max(1, len(frames)))
+        means = [sum(column) / count for column in zip(*frames)]
+        with open(path, "w") as fp:
+            json.dump({"phases": PHASES,
+                       "mean": dict(zip(PHASES, means)),
+                       "frames": frames}, fp)
+        logger.info("Wrote %d frame timings to %s" % (len(frames), path))
+
+    def draw(self, screen):
+        """Draw a stacked graph of recent frame times in the bottom right"""
+        if self.graph is None:
+            self.graph = pygame.Surface(GRAPH_SIZE)
+        graph = self.graph
+        width, height = GRAPH_SIZE
+        scale = height / GRAPH_MS
+        graph.fill((0, 0, 0))
+        frames = self.frames()[-width:]
+        for x, timings in enumerate(frames):
+            y = height
+            for color, value in zip(PHASE_COLORS, timings):
+                h = int(value * scale)
+                if h > 0:
+                    graph.fill(color, (x, y - h, 1, h))
+                    y -= h
+        budget_y = height - int(1000.0 / 60 * scale)
+        pygame.draw.line(graph, (128, 128, 128), (0, budget_y),
+                         (width, budget_y))
+        rect = graph.get_rect()
+        rect.bottomright = screen.get_rect().bottomright
+        return screen.blit(graph, rect)
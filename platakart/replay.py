@@ -0,0 +1,92 @@
+# -*- coding: utf-8; -*-
+
+import logging
+import struct
+import zlib
+
+logger = logging.getLogger("platakart.replay")
+
+MAGIC = b"PKRP"
+VERSION = 2
+# magic, version, seed, physics step, kart count, track name length
+HEADER = struct.Struct("<4sBIdHH")
+# physics steps run, key-up events, checksum of the kart states
+FRAME = struct.Struct("<HHI")
+# key code (pygame 2's arrow keys don't fit in 16 bits), modifiers
+KEY = struct.Struct("<IH")
+
+
+def checksum(state):
+    return zlib.crc32(state.tobytes()) & 0xffffffff
+
+
+class InputRecorder(object):
+    """Writes a TrackScene run to a compact binary file.
+
+    After a header with the random seed, physics step, kart count and
+    track name, each frame stores how many physics steps ran, the key-up
+    events that came before them and a checksum of every kart's bodies
+    afterwards.
+    """
+
+    def __init__(self, path, seed, track_name, kart_count, step_amt):
+        self.fp = open(path, "wb")
+        name = track_name.encode("utf-8")
+        self.fp.write(HEADER.pack(MAGIC, VERSION, seed, step_amt,
+                                  kart_count, len(name)))
+        self.fp.write(name)
+        self.frames = 0
+        logger.debug("Recording input to %s" % path)
+
+    def write_frame(self, keys, steps, state_checksum):
+        write = self.fp.write
+        write(FRAME.pack(steps, len(keys), state_checksum))
+        for key, mod in keys:
+            write(KEY.pack(key, mod))
+        self.frames += 1
+
+    def close(self):
+        self.fp.close()
+        logger.debug("Recorded %d frames" % self.frames)
+
+
+class InputPlayer(object):
+
+    def __init__(self, path):
+        with open(path, "rb") as fp:
+            data = fp.read()
+        (magic, version, seed, step_amt, kart_count,
+         name_len) = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a version %d recording"
+                             % (path, VERSION))
+        offset = HEADER.size
+        self.seed = seed
+        self.step_amt = step_amt
+        self.kart_count = kart_count
+        self.track_name = data[offset:offset + name_len].decode("utf-8")
+        self.data = data
+        self.offset = offset + name_len
+        self.frame = 0
+        self.diverged = False
+        logger.debug("Replaying %s on %s" % (path, self.track_name))
+
+    def next_frame(self):
+        """Return (keys, steps, checksum) for the next frame, or None"""
+        data = self.data
+        if self.offset >= len(data):
+            return None
+        steps, key_count, state_checksum = FRAME.unpack_from(
+            data, self.offset)
+        self.offset += FRAME.size
+        keys = list()
+        for i in range(key_count):
+            keys.append(KEY.unpack_from(data, self.offset))
+            self.offset += KEY.size
+        self.frame += 1
+        return keys, steps, state_checksum
+
+    def verify(self, expected, actual):
+        if expected != actual and not self.diverged:
+            logger.warning("Replay diverged at frame %d" % self.frame)
+            self.diverged = True
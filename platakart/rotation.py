@@ -0,0 +1,76 @@
+# -*- coding: utf-8; -*-
+
+from collections import OrderedDict
+import logging
+
+import pygame.transform
+
+logger = logging.getLogger("platakart.rotation")
+
+DEFAULT_STEPS = 64
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+
+def surface_bytes(surf):
+    w, h = surf.get_size()
+    return w * h * surf.get_bytesize()
+
+
+class RotatedSprite(object):
+    """A sprite pre-rendered at a fixed number of angle buckets."""
+
+    def __init__(self, surf, steps):
+        self.steps = steps
+        self.step_degrees = 360.0 / steps
+        rotozoom = pygame.transform.rotozoom
+        self.frames = [rotozoom(surf, i * self.step_degrees, 1)
+                       for i in range(steps)]
+        self.size = sum(map(surface_bytes, self.frames))
+
+    def get(self, degrees):
+        index = int(round((degrees % 360.0) / self.step_degrees))
+        return self.frames[index % self.steps]
+
+
+class RotationCache(object):
+    """Shares RotatedSprites between every kart that uses the same surface.
+
+    The total size of all pre-rendered frames is kept under max_bytes by
+    dropping the least recently built sprites.  Karts keep a reference to
+    their own RotatedSprite, so eviction only affects karts built later.
+    """
+
+    def __init__(self, steps=DEFAULT_STEPS, max_bytes=DEFAULT_MAX_BYTES):
+        self.steps = steps
+        self.max_bytes = max_bytes
+        self.sprites = OrderedDict()
+        self.size = 0
+
+    def get(self, surf):
+        sprite = self.sprites.pop(surf, None)
+        if sprite is None:
+            sprite = RotatedSprite(surf, self.steps)
+            self.size += sprite.size
+            logger.debug("Pre-rendered %d rotations (%d bytes)"
+                         % (self.steps, sprite.size))
+            self._evict()
+        self.sprites[surf] = sprite
+        return sprite
+
+    def _evict(self):
+        while self.size > self.max_bytes and self.sprites:
+            surf, sprite = self.sprites.popitem(last=False)
+            self.size -= sprite.size
+            logger.debug("Evicted rotations (%d bytes)" % sprite.size)
+        if self.size > self.max_bytes:
+            logger.warning("Rotation cache over budget: %d > %d bytes"
+                           % (self.size, self.max_bytes))
+
+    def clear(self):
+        self.sprites.clear()
+        self.size = 0
+
+    def report(self):
+        logger.debug("Rotation cache: %d sprites, %d/%d bytes"
+                     % (len(self.sprites), self.size, self.max_bytes))
+        return len(self.sprites), self.size, self.max_bytes
@@ -0,0 +1,282 @@
+# -*- coding: utf-8; -*-
+
+from __future__ import print_function
+
+from argparse import ArgumentParser
+from collections import namedtuple
+from functools import partial
+from multiprocessing import Pool
+import json
+import logging
+import math
+import os.path
+import random
+
+import pygame.image
+import pymunk
+
+logger = logging.getLogger("platakart.simulation")
+
+from platakart.collision import use_spatial_hash
+from platakart.fleet import KartFleet
+from platakart.track import GRAVITY
+from platakart.track import Kart
+from platakart.track import KartPerf
+from platakart.track import grid_position
+from platakart.trackcache import add_shapes
+from platakart.trackfile import open_track
+
+RESOURCE_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "resources")
+DEFAULT_CACHE_PATH = os.path.join("~", ".platakart", "cache")
+
+# A race: the track's TMX path, a KartPerf per kart, the name of a
+# policy in POLICIES, the longest race time in seconds, the physics step
+# and the seed for the race's start delays and policy noise.
+RaceSpec = namedtuple(
+    "RaceSpec", "track, perfs, policy, max_time, step_amt, seed")
+
+
+# Longest wait, in seconds, before a kart leaves the grid.
+START_JITTER = 0.5
+
+
+# Policies drive the karts that have left the grid; they are called
+# before every step with the race's own random.Random.
+def throttle_policy(fleet, step, step_amt, rng, started):
+    # Each kart misses about one throttle press in ten.
+    if step % 6 == 0:
+        karts = [i for i in started if rng.random() < 0.9]
+        if karts:
+            fleet.accelerate(Kart.RIGHT, karts)
+
+
+def hop_policy(fleet, step, step_amt, rng, started):
+    throttle_policy(fleet, step, step_amt, rng, started)
+    karts = [i for i in started if rng.random() < 1 / 90.0]
+    if karts:
+        fleet.jump(karts)
+
+
+POLICIES = {"throttle": throttle_policy,
+            "hop": hop_policy}
+
+# Loaded once per process.
+_tracks = dict()
+_sprites = dict()
+
+
+def load_track(path, cache_path=None):
+    track = _tracks.get(path)
+    if track is None:
+        track_file = open_track(path, cache_path)
+        track = (track_file, track_file.shapes())
+        _tracks[path] = track
+    return track
+
+
+def load_sprite(filename):
+    # The karts only need their sprites for their sizes, so they are
+    # never converted and no display is needed.
+    sprite = _sprites.get(filename)
+    if sprite is None:
+        sprite = pygame.image.load(os.path.join(RESOURCE_PATH, filename))
+        _sprites[filename] = sprite
+    return sprite
+
+
+class Race(object):
+    """A render-free race: karts on a track's collision shapes.
+
+    A kart finishes its lap when its chassis reaches the last two tiles
+    of the track.  Airtime counts the time none of a kart's bodies are
+    touching the track.  The seed jitters when each kart leaves the grid
+    and its policy's inputs, so races with different seeds differ.
+    """
+
+    def __init__(self, spec, cache_path=None):
+        self.spec = spec
+        self.policy = POLICIES[spec.policy]
+        self.rng = random.Random(spec.seed)
+        track, shapes = load_track(spec.track, cache_path)
+        self.finish_x = (track.width - 2) * track.tilewidth
+
+        self.space = pymunk.Space()
+        self.space.gravity = GRAVITY
+        add_shapes(self.space, shapes)
+
+        body_surf = load_sprite("greenkart.png")
+        wheel_surf = load_sprite("wheel.png")
+        self.karts = list()
+        for i, perf in enumerate(spec.perfs):
+            kart = Kart("kart-%d" % i, self.space,
+                        grid_position(i, len(spec.perfs),
+                                      body_surf.get_size()),
+                        body_surf, wheel_surf, KartPerf(*perf))
+            kart.init_physics()
+            self.karts.append(kart)
+        self.fleet = KartFleet(self.karts)
+        self.start_delays = [self.rng.uniform(0, START_JITTER)
+                             for kart in self.karts]
+        use_spatial_hash(self.space, track.tilewidth)
+
+        self.owners = dict()
+        for i, kart in enumerate(self.karts):
+            for body in [kart.chassis] + kart.wheels:
+                self.owners[body] = i
+        self.contacts = [0] * len(self.karts)
+        self.space.set_default_collision_handler(
+            begin=self.on_begin, separate=self.on_separate)
+
+    def _touch(self, arbiter, amount):
+        # Only contacts with the track count, not karts touching karts.
+        a, b = arbiter.shapes
+        for shape, other in ((a, b), (b, a)):
+            i = self.owners.get(shape.body)
+            if i is not None and other.body.is_static:
+                self.contacts[i] += amount
+
+    def on_begin(self, space, arbiter, *args, **kwargs):
+        self._touch(arbiter, 1)
+        return True
+
+    def on_separate(self, space, arbiter, *args, **kwargs):
+        self._touch(arbiter, -1)
+
+    def run(self):
+        spec = self.spec
+        step_amt = spec.step_amt
+        fleet = self.fleet
+        count = len(self.karts)
+        lap_times = [None] * count
+        airtime = [0.0] * count
+        distance = [0.0] * count
+        last = fleet.positions().copy()
+        max_steps = int(spec.max_time / step_amt)
+
+        for step in range(max_steps):
+            started = [i for i in range(count)
+                       if step * step_amt >= self.start_delays[i]]
+            self.policy(fleet, step, step_amt, self.rng, started)
+            fleet.apply()
+            self.space.step(step_amt)
+            positions = fleet.read_state()[::fleet.bodies_per_kart, :2]
+            t = (step + 1) * step_amt
+            for i in range(count):
+                if lap_times[i] is not None:
+                    continue
+                x, y = positions[i]
+                distance[i] += math.hypot(x - last[i][0], y - last[i][1])
+                if self.contacts[i] <= 0:
+                    airtime[i] += step_amt
+                if x >= self.finish_x:
+                    lap_times[i] = t
+            last = positions.copy()
+            if None not in lap_times:
+                break
+
+        return [{"perf": list(perf),
+                 "lap_time": lap_times[i],
+                 "airtime": airtime[i],
+                 "distance": distance[i]}
+                for i, perf in enumerate(spec.perfs)]
+
+
+def run_race(spec, cache_path=None):
+    return Race(spec, cache_path).run()
+
+
+def aggregate(results):
+    """Summarise kart results by KartPerf"""
+    by_perf = dict()
+    for race in results:
+        for kart in race:
+            by_perf.setdefault(tuple(kart["perf"]), list()).append(kart)
+
+    summary = list()
+    for perf, karts in sorted(by_perf.items()):
+        laps = [k["lap_time"] for k in karts if k["lap_time"] is not None]
+        n = float(len(karts))
+        summary.append({
+            "perf": list(perf),
+            "karts": len(karts),
+            "finished": len(laps),
+            "best_lap": min(laps) if laps else None,
+            "mean_lap": sum(laps) / len(laps) if laps else None,
+            "mean_airtime": sum(k["airtime"] for k in karts) / n,
+            "mean_distance": sum(k["distance"] for k in karts) / n})
+    return summary
+
+
+def run_races(specs, processes=None, cache_path=None):
+    """Run every RaceSpec on a process pool and aggregate the results.
+
+    Compiled tracks are kept in cache_path, or next to the TMX files.
+    """
+    # Compile the tracks here rather than in every worker at once.
+    for track in set(spec.track for spec in specs):
+        open_track(track, cache_path).close()
+    pool = Pool(processes)
+    try:
+        results = pool.map(partial(run_race, cache_path=cache_path), specs)
+    finally:
+        pool.close()
+        pool.join()
+    return aggregate(results)
+
+
+def parse_perf(value):
+    return tuple(float(v) for v in value.split(","))
+
+
+def main():
+    parser = ArgumentParser(prog="platakart.simulation",
+                            description="Simulate races without rendering")
+    parser.add_argument("--track", default="testtrack1.tmx",
+                        help="TMX file, relative to the resources folder")
+    parser.add_argument("--perf", type=parse_perf, action="append",
+                        help="max_motor_rate,acceleration_rate,break_rate "
+                        "of a kart; repeat for more karts")
+    parser.add_argument("--policy", choices=sorted(POLICIES),
+                        default="throttle")
+    parser.add_argument("--races", type=int, default=100)
+    parser.add_argument("--max-time", type=float, default=120.0,
+                        help="Seconds before an unfinished race is stopped")
+    parser.add_argument("--physics-fps", type=float, default=60.0)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_PATH,
+                        help="Where to keep compiled tracks "
+                        "(defaults to the game's track cache)")
+    parser.add_argument("--output", default=None,
+                        help="Write the summary as JSON to this file")
+    parser.add_argument(
+        "--log-level",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+        default="WARNING", help="Verbosity of logging output")
+    args = parser.parse_args()
+    logging.basicConfig(level=getattr(logging, args.log_level))
+
+    perfs = args.perf or [(100, 8, 15)]
+    track = os.path.join(RESOURCE_PATH, args.track)
+    specs = [RaceSpec(track, perfs, args.policy, args.max_time,
+                      1.0 / args.physics_fps, seed)
+             for seed in range(args.races)]
+    summary = run_races(specs, args.processes,
+                        os.path.expanduser(args.cache_dir))
+
+    for row in summary:
+        print("perf %-18s finished %d/%d  best %s  mean %s  "
+              "airtime %.2fs  distance %.0f" % (
+                  ",".join("%g" % v for v in row["perf"]),
+                  row["finished"], row["karts"],
+                  "%.2fs" % row["best_lap"] if row["finished"] else "-",
+                  "%.2fs" % row["mean_lap"] if row["finished"] else "-",
+                  row["mean_airtime"], row["mean_distance"]))
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(summary, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# -*- coding: utf-8; -*-
+
+import random
+import unittest
+
+from platakart.collision import merge_boxes
+
+
+def cells(boxes):
+    """Unit cells covered by integer boxes, with a count for each"""
+    counts = dict()
+    for left, bottom, right, top in boxes:
+        for x in range(left, right):
+            for y in range(bottom, top):
+                counts[(x, y)] = counts.get((x, y), 0) + 1
+    return counts
+
+
+def random_boxes(rng, count, size=20):
+    boxes = list()
+    for i in range(count):
+        left = rng.randint(0, size - 1)
+        bottom = rng.randint(0, size - 1)
+        boxes.append((left, bottom, rng.randint(left + 1, size),
+                      rng.randint(bottom + 1, size)))
+    return boxes
+
+
+class MergeBoxesTest(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertEqual(merge_boxes([]), [])
+
+    def test_row_of_tiles(self):
+        tiles = [(x, 0, x + 1, 1) for x in range(5)]
+        self.assertEqual(merge_boxes(tiles), [(0, 0, 5, 1)])
+
+    def test_random_boxes(self):
+        rng = random.Random(17)
+        for i in range(200):
+            boxes = random_boxes(rng, rng.randint(1, 12))
+            merged = merge_boxes(boxes)
+            covered = cells(merged)
+            # Same area, and no cell covered twice.
+            self.assertEqual(set(covered), set(cells(boxes)))
+            self.assertEqual(set(covered.values()), set([1]))
+
+
+if __name__ == "__main__":
+    unittest.main()
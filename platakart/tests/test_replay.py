@@ -0,0 +1,49 @@
+# -*- coding: utf-8; -*-
+
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from platakart.replay import InputPlayer
+from platakart.replay import InputRecorder
+
+
+class ReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "run.pkrp")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        # pygame 2's K_RIGHT, and more steps and keys than fit in a byte
+        frames = [([], 1, 0),
+                  ([(0x4000004F, 0), (0x40000050, 64)], 3, 0xdeadbeef),
+                  ([(32, 1)] * 300, 400, 12345)]
+        recorder = InputRecorder(self.path, 42, u"testtrack1", 16, 1 / 60.0)
+        for keys, steps, state_checksum in frames:
+            recorder.write_frame(keys, steps, state_checksum)
+        recorder.close()
+
+        player = InputPlayer(self.path)
+        self.assertEqual(player.seed, 42)
+        self.assertEqual(player.track_name, u"testtrack1")
+        self.assertEqual(player.kart_count, 16)
+        self.assertAlmostEqual(player.step_amt, 1 / 60.0)
+        for keys, steps, state_checksum in frames:
+            self.assertEqual(player.next_frame(),
+                             (keys, steps, state_checksum))
+        self.assertIsNone(player.next_frame())
+
+    def test_rejects_other_versions(self):
+        with open(self.path, "wb") as fp:
+            fp.write(b"PKRP\x01" + b"\0" * 32)
+        self.assertRaises(ValueError, InputPlayer, self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8; -*-
+
+import os.path
+import unittest
+
+import pytmx
+
+from platakart.track import TrackScene
+from platakart.track import grid_position
+
+RESOURCE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+    "resources")
+# greenkart.png and wheel.png
+BODY_SIZE = (125, 35)
+WHEEL_RADIUS = 13
+
+
+def spawn_box(position):
+    """(left, bottom, right, top) of a kart as Kart.init_physics sets it up"""
+    x, y = position
+    width, height = BODY_SIZE
+    # The chassis is a segment as wide as the body with a radius of half
+    # its height; the wheels hang four radii below it.
+    half = width / 2.0 + height // 2
+    return (x - half, y - WHEEL_RADIUS * 5, x + half, y + height // 2)
+
+
+class GridPositionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scene = TrackScene(None, dict())
+        self.scene.tmx_data = pytmx.TiledMap(
+            os.path.join(RESOURCE_PATH, "testtrack1.tmx"))
+
+    def test_single_kart(self):
+        self.assertEqual(grid_position(0, 1, BODY_SIZE), (200, 630))
+
+    def test_spawn_boxes(self):
+        width, height = self.scene.map_size()
+        for n in (1, 2, 8, 16, 32, 64):
+            boxes = [spawn_box(grid_position(i, n, BODY_SIZE))
+                     for i in range(n)]
+            for left, bottom, right, top in boxes:
+                self.assertTrue(0 <= left and right <= width)
+                self.assertTrue(0 <= bottom and top <= height)
+            boxes.sort()
+            for a, b in zip(boxes, boxes[1:]):
+                self.assertTrue(a[2] < b[0], "%r overlaps %r" % (a, b))
+
+    def test_pole_position_first(self):
+        xs = [grid_position(i, 8, BODY_SIZE)[0] for i in range(8)]
+        self.assertEqual(xs, sorted(xs, reverse=True))
+        ys = set(grid_position(i, 8, BODY_SIZE)[1] for i in range(8))
+        self.assertEqual(len(ys), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
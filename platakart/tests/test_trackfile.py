@@ -0,0 +1,98 @@
+# -*- coding: utf-8; -*-
+
+import base64
+import os.path
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+
+from platakart.trackfile import TrackFile
+from platakart.trackfile import compile_track
+
+TMX = """<?xml version="1.0" encoding="UTF-8"?>
+<map version="1.0" orientation="orthogonal" width="3" height="2"
+     tilewidth="32" tileheight="16">
+ <properties>
+  <property name="name" value="Test Track"/>
+  <property name="description" value="Two rows"/>
+ </properties>
+ <layer name="ground" width="3" height="2">
+  <data encoding="csv">
+1,2,3,
+4,5,0
+</data>
+ </layer>
+ <layer name="scenery" width="3" height="2">
+  <data encoding="base64" compression="zlib">%s</data>
+ </layer>
+</map>
+"""
+
+SCENERY = [7, 0, 0, 0, 0, 2147483657]
+
+SHAPES = [
+    ((None, (0.0, 0.0), 0.0),
+     [(("poly", [(0.0, 0.0), (96.0, 0.0), (96.0, 16.0), (0.0, 16.0)]),
+       (0.5, 0.25, 1, 0, 0xffffffff, False)),
+      (("segment", (0.0, 32.0), (96.0, 32.0), 2.0),
+       (1.0, 0.0, 0, 0, 1, False))]),
+    (((5.0, 10.0), (48.0, 24.0), 0.5),
+     [(("circle", 8.0, (0.0, 0.0)),
+       (0.75, 0.5, 2, 3, 2, True))])]
+
+
+class TrackFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.dir, "track.tmx")
+        self.target = os.path.join(self.dir, "track.pkt")
+        data = zlib.compress(struct.pack("<6I", *SCENERY))
+        with open(self.source, "w") as fp:
+            fp.write(TMX % base64.b64encode(data).decode("ascii"))
+        compile_track(self.source, self.target, SHAPES)
+        self.track = TrackFile(self.target)
+
+    def tearDown(self):
+        self.track.close()
+        shutil.rmtree(self.dir)
+
+    def test_header(self):
+        track = self.track
+        self.assertEqual((track.width, track.height), (3, 2))
+        self.assertEqual((track.tilewidth, track.tileheight), (32, 16))
+        self.assertEqual(track.shape_count, 3)
+
+    def test_properties(self):
+        self.assertEqual(self.track.properties,
+                         {"name": "Test Track", "description": "Two rows"})
+        self.assertEqual(self.track.name, "Test Track")
+        self.assertEqual(self.track.description, "Two rows")
+        self.assertIsNone(self.track.thumbnail)
+
+    def test_layers(self):
+        self.assertEqual(self.track.layer_names, ["ground", "scenery"])
+        self.assertEqual(self.track.get_layer("ground").tolist(),
+                         [[1, 2, 3], [4, 5, 0]])
+        self.assertEqual(self.track.get_layer("scenery").tolist(),
+                         [SCENERY[:3], SCENERY[3:]])
+
+    def test_shapes(self):
+        self.assertEqual(self.track.shapes(), SHAPES)
+
+    def test_read_shapes(self):
+        offsets = self.track.shape_offsets()
+        self.assertEqual(len(offsets), 3)
+        self.assertEqual(self.track.read_shapes(offsets[2:]), SHAPES[1:])
+
+    def test_rejects_other_versions(self):
+        with open(self.target, "r+b") as fp:
+            fp.seek(4)
+            fp.write(b"\xff")
+        self.assertRaises(ValueError, TrackFile, self.target)
+
+
+if __name__ == "__main__":
+    unittest.main()
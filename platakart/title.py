@@ -7,7 +7,12 @@ import pygame.font
 import pygame.draw
 logger = logging.getLogger("platakart.title")
 
+from platakart.dispatch import subscriptions
+from platakart.display import display
+from platakart.ui import Button
+from platakart.ui import Compositor
 from platakart.ui import Scene
+from platakart.ui import TextSprite
 from platakart.ui import WHITE
 from platakart.ui import BLACK
 
@@ -20,14 +25,14 @@ class TitleScene(Scene):
     def __init__(self, resources):
         self.started_loading_resources = False
         self.render_title = False
-        self.render_percent = False
         self.render_button = False
         self.resources = resources
         self.loader_gen = None
         self.loaded = False
         self.font = None
-        self.percent_surf = None
-        self.button_rect = None
+        self.percent_text = None
+        self.percent_sprite = None
+        self.compositor = None
         self.fading_out = -0.1
 
     def get_name(self):
@@ -35,99 +40,74 @@ class TitleScene(Scene):
 
     def setup(self):
         logger.debug("Setting up title scene")
-        self.font = pygame.font.SysFont("Verdana", 32)
-        pub.subscribe(self.on_resource_loaded, "resources.loading")
-        pub.subscribe(self.on_mouse_down, "input.mouse-down")
-        pub.subscribe(self.on_mouse_up, "input.mouse-up")
+        self.font = self.resources.fonts.get("menu")
+        subscriptions.subscribe(self.on_resource_loaded, "resources.loading")
+        subscriptions.subscribe(self.on_button_clicked, "button.clicked")
 
     def teardown(self):
         logger.debug("Tearing down title scene")
         self.font = None
-        self.percent_surf = None
+        self.percent_text = None
+        self.percent_sprite = None
+        self.compositor = None
         self.render_title = False
-        self.render_percent = False
-        pub.unsubscribe(self.on_resource_loaded, "resources.loading")
-        pub.unsubscribe(self.on_mouse_down, "input.mouse-down")
-        pub.unsubscribe(self.on_mouse_up, "input.mouse-up")
 
     def on_resource_loaded(self, percent, category, key):
         if category == "image" and key == "title":
             self.render_title = True
         else:
-            self.percent_surf = self.font.render(
-                "Loading %d%%" % int(percent * 100), True, PERCENT_COLOR)
-            if int(percent) != 1:
-                self.render_percent = True
-            elif int(percent) == 1:
+            self.percent_text = "Loading %d%%" % int(percent * 100)
+            if int(percent) == 1:
                 pub.sendMessage("game.play-sound", name="menu-theme", loops=-1)
                 self.render_button = True
 
-    def on_mouse_down(self, pos, button):
-        if self.button_rect:
-            if self.button_rect.collidepoint(pos):
-                self.render_button = "hover"
-
-    def on_mouse_up(self, pos, button):
-        if self.button_rect:
-            if self.button_rect.collidepoint(pos):
-                logger.debug("Mouse clicked button")
-                pub.sendMessage("game.play-sound", name="menu-select")
-                pub.sendMessage("game.stop-sound",
-                                name="menu-theme",
-                                fade_ms=100)
-                self.fading_out = 0.0
-            self.render_button = "normal"
-
+    def on_button_clicked(self, id):
+        if id == "play":
+            logger.debug("Mouse clicked button")
+            pub.sendMessage("game.stop-sound",
+                            name="menu-theme",
+                            fade_ms=100)
+            pub.sendMessage("game.prefetch-scene", name="track",
+                            options={"trackname": "testtrack1"})
+            self.fading_out = 0.0
 
     def update(self, screen, delta):
         if not self.loaded:
             if self.loader_gen is None:
-                self.loader_gen = self.resources.load()
+                self.loader_gen = self.resources.load(
+                    self.resources.manifest(self.get_name()))
             else:
                 try:
                     self.loader_gen.next()
                 except StopIteration:
                     self.loaded = True
 
+        screen_rect = screen.get_rect()
         if self.render_title:
-            screen_rect = screen.get_rect()
-            screen.blit(self.resources.images["title"], screen_rect)
-            pygame.display.flip()
+            self.compositor = Compositor(self.resources.images["title"])
+            self.percent_sprite = TextSprite(
+                self.font, PERCENT_COLOR,
+                (screen_rect.centerx, screen_rect.height * .75),
+                anchor="midtop")
+            self.compositor.add(self.percent_sprite)
             self.render_title = False
 
-        if self.render_percent:
-            screen_rect = screen.get_rect()
-            surf_copy = self.percent_surf.copy()
-            surf_copy.fill((0, 0, 0))
-            surf_rect = surf_copy.get_rect()
-            x = screen_rect.centerx - (surf_rect.width // 2)
-            y = screen_rect.height * .75
-            screen.blit(surf_copy, (x, y))
-            rect = screen.blit(self.percent_surf, (x, y))
-            pygame.display.update(rect)
-            self.render_percent = False
+        if self.compositor is None:
+            return
 
-        if self.render_button:
-            screen_rect = screen.get_rect()
-
-            if self.render_button == "hover":
-                add_y = 4
-                img = self.resources.images["red_button_down"]
-            else:
-                add_y = 0
-                img = self.resources.images["red_button_up"]
+        if self.percent_text is not None:
+            self.percent_sprite.set_text(self.percent_text)
+            self.percent_text = None
 
+        if self.render_button:
+            img = self.resources.images["red_button_up"]
             surf_rect = img.get_rect()
             x = screen_rect.centerx - (surf_rect.width // 2)
-            y = (screen_rect.height * .75) + add_y
-            screen.blit(self.resources.images["title"], screen_rect)
-            button_rect = screen.blit(img, (x, y))
-            self.button_rect = button_rect
-            label_surf = self.font.render("PLAY", True, PERCENT_COLOR)
-            label_rect = label_surf.get_rect()
-            label_rect.center = button_rect.center
-            screen.blit(label_surf, label_rect)
-            pygame.display.flip()
+            y = screen_rect.height * .75
+            self.percent_sprite.kill()
+            self.compositor.add(Button(
+                "play", "PLAY", self.font, (x, y), img,
+                self.resources.images["red_button_down"]))
             self.render_button = False
 
         if self.fading_out >= 100:
@@ -139,4 +119,6 @@ class TitleScene(Scene):
             amt = fade_rect.height * float(self.fading_out) / 100.0
             fade_rect.height = int(amt)
             pygame.draw.rect(screen, FADE_COLOR, fade_rect)
-            pygame.display.update(fade_rect)
+            display.update(fade_rect)
+        else:
+            self.compositor.present(screen)
@@ -2,10 +2,10 @@
 
 import logging
 import random
+import time
 
 logger = logging.getLogger("platakart.track")
 
-from pubsub import pub
 import pygame.display
 import pygame.sprite
 import pygame.draw
@@ -17,8 +17,23 @@ from pygame import K_DOWN
 from pygame import K_LEFT
 from pygame import K_RIGHT
 from pygame import K_UP
-from pymunktmx.shapeloader import load_shapes
 
+from platakart.chunks import TrackChunks
+from platakart.collision import use_spatial_hash
+from platakart.dispatch import inputs
+from platakart.display import display
+from platakart.dispatch import subscriptions
+from platakart.fleet import KartFleet
+from platakart.minimap import DEFAULT_SCALE as MINI_MAP_SCALE
+from platakart.minimap import MiniMap
+from platakart.replay import InputPlayer
+from platakart.replay import InputRecorder
+from platakart.replay import checksum
+from platakart.rotation import DEFAULT_MAX_BYTES
+from platakart.rotation import DEFAULT_STEPS
+from platakart.rotation import RotationCache
+from platakart.trackcache import add_shapes
+from platakart.trackcache import build_shapes
 from platakart.ui import BLACK
 from platakart.ui import Scene
 
@@ -27,6 +42,29 @@ from collections import namedtuple
 KartPerf = namedtuple(
     "KartPerf", "max_motor_rate, acceleration_rate, break_rate")
 
+GRAVITY = (0.0, -900.0)
+# The keys that drive the karts, and the only ones recorded and replayed.
+CONTROL_KEYS = (K_RIGHT, K_LEFT, K_UP, K_DOWN)
+
+
+# Where the last kart on the grid starts, the old single kart's spot.
+GRID_BACK = (200, 630)
+# Space left between the chassis of neighbouring karts.
+GRID_GAP = 2
+
+
+def grid_position(index, count, body_size):
+    """Start position of kart index of count, pole position first.
+
+    Karts line up in single file, each behind the one before it, all at
+    the same height.  The chassis segment's rounded ends stick out past
+    each end of the body by its radius, half the body height, so both
+    are added to the body width to space them.
+    """
+    width, height = body_size
+    pitch = width + 2 * (height // 2) + GRID_GAP
+    return (GRID_BACK[0] + (count - 1 - index) * pitch, GRID_BACK[1])
+
 
 class Kart(pygame.sprite.Sprite):
 
@@ -43,10 +81,11 @@ class Kart(pygame.sprite.Sprite):
     WHEEL_VERTICAL_OFFSET = .79858
 
     def __init__(self, id, space, start_pos, body_surf, wheel_surf,
-                 kart_perf):
+                 kart_perf, rotation_cache=None):
         super(Kart, self).__init__()
         self.id = id
         self.body_surf = body_surf
+        self.body_rotations = None
         self.chassis = None
         self.direction = self.LEFT
         self.map_data = None
@@ -54,12 +93,18 @@ class Kart(pygame.sprite.Sprite):
         self.motors = list()
         self.perf = kart_perf
         self.physics_initialized = False
+        self.render_state = None
         self.space = space
         self.start_pos = start_pos
         self.tmx_data = None
         self.wheel_surf = wheel_surf
+        self.wheel_rotations = None
         self.wheels = list()
 
+        if rotation_cache is not None:
+            self.body_rotations = rotation_cache.get(body_surf)
+            self.wheel_rotations = rotation_cache.get(wheel_surf)
+
     def _make_wheel(self, chassis_body, body_rect, mass,
                     h_offset_percent, v_offset_percent):
         wheel_rect = self.wheel_surf.get_rect()
@@ -139,44 +184,46 @@ class Kart(pygame.sprite.Sprite):
     def update(self):
         pass
 
-    def draw(self, screen):
+    def body_states(self):
+        return [(body.position.x, body.position.y, body.angle)
+                for body in [self.chassis] + self.wheels]
+
+    def get_render_state(self):
+        if self.render_state is None:
+            return self.body_states()
+        return self.render_state
+
+    def rotate(self, surf, rotations, degrees):
+        if rotations is None:
+            return pygame.transform.rotozoom(surf, degrees, 1)
+        return rotations.get(degrees)
+
+    def draw(self, screen, map_height=None, offset=(0, 0)):
+        """Draw with y flipped against map_height and shifted by -offset"""
         degs_per_rad = 57.2957795
-        for wheel in self.wheels:
-            x, y = wheel.position
+        if map_height is None:
+            map_height = screen.get_height()
+        ox, oy = offset
+        states = self.get_render_state()
+        for x, y, angle in states[1:]:
             w, h = self.wheel_surf.get_size()
-            wheel_surf = pygame.transform.rotozoom(
-                self.wheel_surf, wheel.angle * degs_per_rad, 1)
+            wheel_surf = self.rotate(self.wheel_surf, self.wheel_rotations,
+                                     angle * degs_per_rad)
             ww, hh = wheel_surf.get_size()
-            rrect = pygame.Rect(x+4, screen.get_height() - y - h + 30, ww, hh)
+            rrect = pygame.Rect(x + 4 - ox, map_height - y - h + 30 - oy,
+                                ww, hh)
             rrect.move_ip((w-ww) / 2, (h-hh) / 2)
             screen.blit(wheel_surf, rrect.topleft)
 
-        body_surf = pygame.transform.rotozoom(
-            self.body_surf, (self.chassis.angle * degs_per_rad) % 360, 1)
-        p = pymunk.pygame_util.to_pygame(self.chassis.position, screen)
+        x, y, angle = states[0]
+        body_surf = self.rotate(self.body_surf, self.body_rotations,
+                                (angle * degs_per_rad) % 360)
         r = body_surf.get_rect()
-        r.topleft = p
+        r.topleft = (int(x) - ox, int(map_height - y) - oy)
         r.left -= 43
         r.top += 12
         screen.blit(body_surf, r)
 
-    def accelerate(self, direction):
-        amt = direction * self.perf.acceleration_rate
-        for motor in self.motors:
-            if abs(motor.rate + amt) < self.perf.max_motor_rate:
-                motor.rate += amt
-
-    def decelerate(self):
-        amt = self.direction * self.perf.break_rate
-        for motor in self.motors:
-            motor.rate -= amt
-            if self.direction == self.RIGHT:
-                if motor.rate < 0:
-                    motor.rate = 0
-            elif self.direction == self.LEFT:
-                if motor.rate > 0:
-                    motor.rate = 0
-
     def jump(self):
         impulse = (0, self.JUMP_IMPULSE)
         self.chassis.apply_impulse(impulse)
@@ -190,58 +237,284 @@ class TrackScene(Scene):
         self.resources = resources
         self.space = None
         self.karts = None
-        self.step_amt = 1.0 / (float(conf.get("target_fps", 30)))
+        self.fleet = None
+        self.kart_count = int(conf.get("kart_count", 1))
+        self.physics_step = 1.0 / float(
+            conf.get("physics_fps", conf.get("target_fps", 30)))
+        self.step_amt = self.physics_step
+        self.max_steps = int(conf.get("max_physics_steps", 5))
+        self.accumulator = 0.0
+        self.record_path = conf.get("record_input")
+        self.replay_path = conf.get("replay_input")
+        self.recorder = None
+        self.player = None
+        self.feeding_replay = False
+        self.frame_keys = list()
         self.camera = None
         self.buff = None
+        self.prepared = None
         self.wireframe_mode = int(conf.get("wireframe_mode", 0))
         self.show_mini_map = int(conf.get("show_mini_map", 0))
+        self.mini_map = None
+        self.mini_map_scale = float(
+            conf.get("mini_map_scale", MINI_MAP_SCALE))
+        self.mini_map_refresh = int(conf.get("mini_map_refresh_ms", 0))
+        self.viewport_rendering = int(conf.get("viewport_rendering", 1))
+        self.spatial_hash = int(conf.get("spatial_hash", 1))
+        self.chunk_tiles = int(conf.get("chunk_tiles", 0))
+        self.chunks_ahead = int(conf.get("chunks_ahead", 1))
+        self.chunks = None
+        self.rotation_cache = RotationCache(
+            int(conf.get("rotation_steps", DEFAULT_STEPS)),
+            int(conf.get("rotation_cache_bytes", DEFAULT_MAX_BYTES)))
         logger.debug("Calculated space step amount = %f" % self.step_amt)
 
     def get_name(self):
         return "track"
 
+    def get_resources(self, options=None):
+        if options and options.get("trackname"):
+            items = [("tilemap", options["trackname"])]
+            if self.chunk_tiles:
+                items.append(("track", options["trackname"]))
+            return items
+        return list()
+
+    def prepare(self, options=None):
+        track_name = (options or dict()).get("trackname")
+        if not track_name or self.replay_path:
+            return
+        prepared = {"trackname": track_name}
+        tmx_data = self.resources.get("tilemap", track_name)
+        yield
+        prepared["map_data"] = pyscroll.TiledMapData(tmx_data)
+        yield
+        prepared["map_layer"] = pyscroll.BufferedRenderer(
+            prepared["map_data"], display.render_size)
+        yield
+        if not self.chunk_tiles:
+            prepared["shapes"] = build_shapes(
+                self.resources.track_shapes[track_name])
+            yield
+        if self.use_back_buffer():
+            self.tmx_data = tmx_data
+            prepared["buff"] = pygame.Surface(
+                self.map_size(), 0, display.screen)
+        self.prepared = prepared
+        logger.debug("Prepared track %s" % track_name)
+
     def setup(self, options=None):
         logger.debug("Setting up track scene")
         self.space = pymunk.Space()
-        self.space.gravity = (0.0, -900.0)
-
+        self.space.gravity = GRAVITY
+        self.accumulator = 0.0
+        self.step_amt = self.physics_step
+        kart_count = self.kart_count
+        seed = int(time.time())
+
+        if self.replay_path:
+            self.player = InputPlayer(self.replay_path)
+            options = dict(options or dict(),
+                           trackname=self.player.track_name)
+            self.step_amt = self.player.step_amt
+            kart_count = self.player.kart_count
+            seed = self.player.seed
+        random.seed(seed)
+
+        track_name = None
+        prepared = self.prepared or dict()
+        self.prepared = None
         if options:
             track_name = options.get("trackname")
+            if prepared.get("trackname") != track_name:
+                prepared = dict()
             if track_name:
-                tmx_data = self.resources.tilemaps[track_name]
+                tmx_data = self.resources.get("tilemap", track_name)
                 self.tmx_data = tmx_data
-                load_shapes(tmx_data, space=self.space)
-                self.map_data = pyscroll.TiledMapData(tmx_data)
-                self.map_layer = pyscroll.BufferedRenderer(self.map_data, (640, 480))
+                shapes = self.resources.track_shapes[track_name]
+                if self.chunk_tiles:
+                    self.chunks = TrackChunks(
+                        self.space, self.resources.get("track", track_name),
+                        self.chunk_tiles * tmx_data.tilewidth,
+                        self.chunks_ahead)
+                elif "shapes" in prepared:
+                    bodies, built = prepared["shapes"]
+                    self.space.add(*(bodies + built))
+                else:
+                    add_shapes(self.space, shapes)
+                if "map_layer" in prepared:
+                    self.map_data = prepared["map_data"]
+                    self.map_layer = prepared["map_layer"]
+                else:
+                    self.map_data = pyscroll.TiledMapData(tmx_data)
+                    self.map_layer = pyscroll.BufferedRenderer(
+                        self.map_data, display.render_size)
+                self.buff = prepared.get("buff")
+                if self.show_mini_map:
+                    self.mini_map = MiniMap(tmx_data, shapes,
+                                            self.mini_map_scale,
+                                            self.mini_map_refresh)
 
         self.karts = list()
         perf = KartPerf(100, 8, 15)
-        green_kart = Kart(
-            "green-kart",
-            self.space,
-            (200, 630),
-            self.resources.images["green-kart"],
-            self.resources.images["wheel"],
-            perf)
-        green_kart.init_physics()
-        self.karts.append(green_kart)
-        pub.subscribe(self.on_key_up, "input.key-up")
+        body_surf = self.resources.images["green-kart"]
+        for i in range(kart_count):
+            kart = Kart(
+                "green-kart-%d" % i,
+                self.space,
+                grid_position(i, kart_count, body_surf.get_size()),
+                body_surf,
+                self.resources.images["wheel"],
+                perf,
+                self.rotation_cache)
+            kart.init_physics()
+            self.karts.append(kart)
+        self.fleet = KartFleet(self.karts)
+        self.rotation_cache.report()
+        if self.chunks is not None:
+            self.chunks.update(self.fleet.positions()[:, 0].tolist())
+        if self.spatial_hash and track_name:
+            use_spatial_hash(self.space, tmx_data.tilewidth)
+
+        if self.record_path and track_name:
+            self.recorder = InputRecorder(self.record_path, seed, track_name,
+                                          kart_count, self.step_amt)
+        self.frame_keys = list()
+        subscriptions.subscribe(self.on_key_up, "input.key-up")
 
     def teardown(self):
         logger.debug("Tearing down track scene")
-        pub.unsubscribe(self.on_key_up, "input.key-up")
+        self.mini_map = None
+        self.camera = None
+        self.buff = None
+        self.prepared = None
+        self.fleet = None
+        self.player = None
+        if self.chunks is not None:
+            logger.debug("Track chunks: %r" % self.chunks.stats())
+            self.chunks.close()
+            self.chunks = None
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def map_size(self):
+        return (self.tmx_data.tilewidth * self.tmx_data.width,
+                self.tmx_data.tileheight * self.tmx_data.height)
+
+    def use_back_buffer(self):
+        # pymunk's debug draw can't be offset by the camera.
+        return not self.viewport_rendering or self.wireframe_mode
 
     def update(self, screen, delta):
         if self.camera is None:
             self.camera = screen.get_rect()
-            size = (self.tmx_data.tilewidth * self.tmx_data.width,
-                    self.tmx_data.tileheight * self.tmx_data.height)
-            self.buff = pygame.Surface(size, 0, screen)
-
-        self.space.step(self.step_amt)
+            if self.use_back_buffer() and self.buff is None:
+                self.buff = pygame.Surface(self.map_size(), 0, screen)
+                logger.debug("Allocated %dx%d back buffer"
+                             % self.buff.get_size())
+
+        profiler = self.profiler
+        steps = None
+        if self.player is not None:
+            frame = self.player.next_frame()
+            if frame is None:
+                logger.debug("Replay finished")
+                self.player = None
+            else:
+                keys, steps, state_checksum = frame
+                self.feed_replay(keys)
+
+        if self.chunks is not None:
+            self.chunks.update(self.fleet.positions()[:, 0].tolist())
+        steps = self.step_physics(delta, steps)
+
+        if self.player is not None:
+            self.player.verify(state_checksum, checksum(self.fleet.state))
+        elif self.recorder is not None:
+            self.recorder.write_frame(self.frame_keys, steps,
+                                      checksum(self.fleet.state))
+            self.frame_keys = list()
+        profiler.mark("physics")
+
+        if self.buff is None:
+            self.draw_viewport(screen)
+        else:
+            self.draw_back_buffer(screen)
+
+        if self.mini_map is not None:
+            self.mini_map.update(delta, self.karts)
+            self.mini_map.draw(screen)
+            profiler.mark("mini-map")
+
+        display.flip()
+        profiler.mark("flip")
+
+    def feed_replay(self, keys):
+        # Recorded keys take the same path as live ones, which are
+        # ignored while replaying.  Only kart controls are fed back;
+        # other keys, such as the profiler's, act on the whole game.
+        KEYUP = pygame.KEYUP
+        self.feeding_replay = True
+        inputs.dispatch([pygame.event.Event(KEYUP, key=key, mod=mod)
+                         for key, mod in keys if key in CONTROL_KEYS])
+        self.feeding_replay = False
+
+    def step_physics(self, delta, steps=None):
+        """Run as many fixed physics steps as delta (in ms) allows.
+
+        At most max_steps are run per frame; time beyond that is dropped so
+        that a slow frame can't cause ever longer catch-up frames.  When
+        replaying, steps is the recorded number of steps to run instead.
+        """
+        step_amt = self.step_amt
+        self.accumulator += delta / 1000.0
+        capped = False
+        if steps is None:
+            steps = int(self.accumulator / step_amt)
+            capped = steps > self.max_steps
+            if capped:
+                steps = self.max_steps
+
+        fleet = self.fleet
+        fleet.apply()
+        for i in range(steps):
+            if i == steps - 1:
+                fleet.read_state()
+                fleet.store_state()
+            self.space.step(step_amt)
+        self.accumulator -= steps * step_amt
+        if capped or not 0 <= self.accumulator < step_amt:
+            self.accumulator = 0.0
+
+        fleet.interpolate(self.accumulator / step_amt)
+        return steps
+
+    def draw_viewport(self, screen):
+        map_size = self.map_size()
+        map_height = map_size[1]
+        x, y, angle = self.karts[0].get_render_state()[0]
+        self.camera.center = (int(x), int(map_height - y))
+        # pyscroll stops its view at the map edges; doing the same here
+        # keeps the karts offset by exactly as much as the tiles.
+        self.camera.clamp_ip(pygame.Rect((0, 0), map_size))
+        self.map_layer.update()
+        self.map_layer.center(self.camera.center)
+        self.map_layer.draw(screen, screen.get_rect())
+        self.profiler.mark("tiles")
+        # Karts are drawn from their chassis position; this margin keeps
+        # those partly on screen.
+        visible = self.camera.inflate(200, 200)
+        for kart in self.karts:
+            x, y, angle = kart.get_render_state()[0]
+            if visible.collidepoint(x, map_height - y):
+                kart.draw(screen, map_height, self.camera.topleft)
+        self.profiler.mark("sprites")
 
+    def draw_back_buffer(self, screen):
+        x, y, angle = self.karts[0].get_render_state()[0]
         self.camera.center = pymunk.pygame_util.to_pygame(
-            self.karts[0].chassis.position, self.buff)
+            (x, y), self.buff)
 
         if self.wireframe_mode:
             # self.buff.fill(BLACK)
@@ -250,28 +523,26 @@ class TrackScene(Scene):
         else:
             self.map_layer.update()
             self.map_layer.draw(self.buff, self.camera)
-            self.karts[0].draw(self.buff)
+            self.profiler.mark("tiles")
+            map_height = self.buff.get_height()
+            visible = self.camera.inflate(200, 200)
+            for kart in self.karts:
+                x, y, angle = kart.get_render_state()[0]
+                if visible.collidepoint(x, map_height - y):
+                    kart.draw(self.buff)
+            self.profiler.mark("sprites")
         screen.blit(self.buff, (0, 0), self.camera)
 
-        if self.show_mini_map:
-            screen_rect = screen.get_rect()
-            buff_rect = self.buff.get_rect()
-            mini_map_rect = pygame.Rect(self.camera)
-            mini_map_rect.width = buff_rect.width * .075
-            mini_map_rect.height = buff_rect.height * .075
-            mini_map = pygame.transform.scale(self.buff, mini_map_rect.size)
-            mini_map_rect.topleft = (0, 0)
-            screen.blit(mini_map, mini_map_rect)
-            
-        pygame.display.flip()
-
     def on_key_up(self, key, mod):
-        for kart in self.karts:
-            if key == K_RIGHT:
-                kart.accelerate(Kart.RIGHT)
-            elif key == K_LEFT:
-                kart.accelerate(Kart.LEFT)
-            elif key == K_UP:
-                kart.jump()
-            elif key == K_DOWN:
-                kart.decelerate()
+        if self.player is not None and not self.feeding_replay:
+            return
+        if self.recorder is not None and key in CONTROL_KEYS:
+            self.frame_keys.append((key, mod))
+        if key == K_RIGHT:
+            self.fleet.accelerate(Kart.RIGHT)
+        elif key == K_LEFT:
+            self.fleet.accelerate(Kart.LEFT)
+        elif key == K_UP:
+            self.fleet.jump()
+        elif key == K_DOWN:
+            self.fleet.decelerate()
@@ -0,0 +1,178 @@
+# -*- coding: utf-8; -*-
+
+import cPickle as pickle
+import glob
+import hashlib
+import logging
+import os
+import os.path
+import tempfile
+import threading
+
+import pymunk
+import pytmx
+from pymunktmx.shapeloader import load_shapes
+
+from platakart.collision import compile_shapes
+
+logger = logging.getLogger("platakart.trackcache")
+
+# Bump when the layout of cache entries changes.
+CACHE_VERSION = 2
+SHAPE_ATTRS = ("friction", "elasticity", "collision_type", "group",
+               "layers", "sensor")
+
+
+def extract_shapes(space):
+    """Describe every shape in space as plain tuples that can be pickled.
+
+    Returns a list of (body, shapes) pairs, where body is None for a
+    static body or (mass, moment), followed by position and angle.
+    """
+    bodies = list()
+    index = dict()
+    for shape in space.shapes:
+        body = shape.body
+        if body not in index:
+            if body.is_static:
+                mass = None
+            else:
+                mass = (body.mass, body.moment)
+            index[body] = len(bodies)
+            bodies.append(((mass, tuple(body.position), body.angle), list()))
+
+        attrs = tuple(getattr(shape, name) for name in SHAPE_ATTRS)
+        if isinstance(shape, pymunk.Poly):
+            verts = [tuple(body.world_to_local(v))
+                     for v in shape.get_vertices()]
+            geometry = ("poly", verts)
+        elif isinstance(shape, pymunk.Segment):
+            geometry = ("segment", tuple(shape.a), tuple(shape.b),
+                        shape.radius)
+        elif isinstance(shape, pymunk.Circle):
+            geometry = ("circle", shape.radius, tuple(shape.offset))
+        else:
+            logger.warning("Can't cache shape %r" % shape)
+            continue
+        bodies[index[body]][1].append((geometry, attrs))
+    return bodies
+
+
+def build_shapes(bodies):
+    """Rebuild shapes described by extract_shapes.
+
+    Returns the dynamic bodies and all of the shapes, ready to be added
+    to a space.  Nothing here touches a space, so it is safe to call
+    from another thread.
+    """
+    dynamic = list()
+    built = list()
+    for (mass, position, angle), shapes in bodies:
+        if mass is None:
+            body = pymunk.Body()
+        else:
+            body = pymunk.Body(*mass)
+            dynamic.append(body)
+        body.position = position
+        body.angle = angle
+
+        for geometry, attrs in shapes:
+            kind = geometry[0]
+            if kind == "poly":
+                shape = pymunk.Poly(body, geometry[1])
+            elif kind == "segment":
+                shape = pymunk.Segment(body, *geometry[1:])
+            else:
+                shape = pymunk.Circle(body, *geometry[1:])
+            for name, value in zip(SHAPE_ATTRS, attrs):
+                setattr(shape, name, value)
+            built.append(shape)
+    return dynamic, built
+
+
+def add_shapes(space, bodies):
+    """Rebuild shapes described by extract_shapes and add them to space"""
+    dynamic, shapes = build_shapes(bodies)
+    space.add(*(dynamic + shapes))
+
+
+def parse_track(path):
+    tilemap = pytmx.TiledMap(path)
+    space = pymunk.Space()
+    load_shapes(tilemap, space=space)
+    return tilemap, compile_shapes(extract_shapes(space))
+
+
+class TrackCache(object):
+    """Parsed tracks and their collision shapes, cached on disk.
+
+    Entries are named after the source file and a hash of its contents
+    and mtime, so editing a track makes its old entry unreachable; the
+    stale entry is deleted when the new one is written.  Loads of one
+    source are serialised, so a tilemap and a compiled track decoded
+    on different threads share a single parse.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.source_locks = dict()
+
+    def source_lock(self, source):
+        with self.lock:
+            return self.source_locks.setdefault(source, threading.Lock())
+
+    def entry_path(self, source):
+        with open(source, "rb") as fp:
+            digest = hashlib.sha1(fp.read())
+        stat = os.stat(source)
+        digest.update("%d:%d:%d" % (CACHE_VERSION, stat.st_mtime,
+                                    stat.st_size))
+        name = os.path.basename(source)
+        return os.path.join(self.path,
+                            "%s-%s.cache" % (name, digest.hexdigest()))
+
+    def load(self, source):
+        """Return (tilemap, shapes) for a TMX file, parsing it if needed.
+
+        The tilemap has no images loaded; shapes is a list from
+        extract_shapes.
+        """
+        with self.source_lock(source):
+            return self._load(source)
+
+    def _load(self, source):
+        entry = self.entry_path(source)
+        try:
+            with open(entry, "rb") as fp:
+                result = pickle.load(fp)
+            logger.debug("Loaded %s from cache" % source)
+            return result
+        except IOError:
+            pass
+        except Exception as ex:
+            logger.warning("Ignoring bad cache entry %s" % entry)
+            logger.exception(ex)
+
+        result = parse_track(source)
+        try:
+            self.store(source, entry, result)
+        except Exception as ex:
+            logger.warning("Unable to cache %s" % source)
+            logger.exception(ex)
+        return result
+
+    def store(self, source, entry, result):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        pattern = "%s-*.cache" % os.path.basename(source)
+        for stale in glob.glob(os.path.join(self.path, pattern)):
+            logger.debug("Removing stale cache entry %s" % stale)
+            os.remove(stale)
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.path)
+        with os.fdopen(fd, "wb") as fp:
+            pickle.dump(result, fp, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, entry)
+        logger.debug("Cached %s in %s" % (source, entry))
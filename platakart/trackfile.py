@@ -0,0 +1,313 @@
+# -*- coding: utf-8; -*-
+
+from __future__ import print_function
+
+from argparse import ArgumentParser
+import base64
+import glob
+import gzip
+import io
+import logging
+import math
+import mmap
+import os
+import os.path
+import struct
+import tempfile
+import xml.etree.ElementTree as ElementTree
+import zlib
+
+import numpy
+
+logger = logging.getLogger("platakart.trackfile")
+
+from platakart.trackcache import parse_track
+
+RESOURCE_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "resources")
+EXTENSION = ".pkt"
+
+MAGIC = b"PKTK"
+VERSION = 1
+# magic, version, width and height in tiles, tile width and height,
+# property count, layer count, shape count
+HEADER = struct.Struct("<4sBHHHHHHI")
+LENGTH = struct.Struct("<H")
+# kind, vertex count, mass and moment (NaN for static bodies), body
+# position and angle, radius, then the SHAPE_ATTRS
+SHAPE = struct.Struct("<BHdddddddd3IB")
+VERTEX = struct.Struct("<dd")
+KINDS = ("poly", "segment", "circle")
+
+
+def pack_string(value):
+    data = value.encode("utf-8")
+    return LENGTH.pack(len(data)) + data
+
+
+def read_layer_data(data_node, width, height):
+    """Tiled gids of a <data> element, as little-endian uint32 bytes"""
+    encoding = data_node.get("encoding")
+    compression = data_node.get("compression")
+    if encoding == "csv":
+        gids = [int(v) for v in data_node.text.replace("\n", "").split(",")]
+        return struct.pack("<%dI" % len(gids), *gids)
+    elif encoding != "base64":
+        raise ValueError("Unsupported layer encoding %r" % encoding)
+
+    data = base64.b64decode(data_node.text.strip())
+    if compression == "zlib":
+        data = zlib.decompress(data)
+    elif compression == "gzip":
+        data = gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+    elif compression:
+        raise ValueError("Unsupported layer compression %r" % compression)
+    if len(data) != width * height * 4:
+        raise ValueError("Layer data is %d bytes, expected %d"
+                         % (len(data), width * height * 4))
+    return data
+
+
+def pack_shapes(bodies):
+    records = list()
+    count = 0
+    nan = float("nan")
+    for (mass, position, angle), shapes in bodies:
+        mass, moment = (nan, nan) if mass is None else mass
+        for geometry, attrs in shapes:
+            kind = geometry[0]
+            radius = 0.0
+            if kind == "poly":
+                verts = geometry[1]
+            elif kind == "segment":
+                verts = geometry[1:3]
+                radius = geometry[3]
+            else:
+                radius = geometry[1]
+                verts = [geometry[2]]
+            friction, elasticity, collision_type, group, layers, sensor = attrs
+            records.append(SHAPE.pack(
+                KINDS.index(kind), len(verts), mass, moment,
+                position[0], position[1], angle, radius, friction,
+                elasticity, collision_type, group, layers & 0xffffffff,
+                sensor))
+            for vert in verts:
+                records.append(VERTEX.pack(*vert))
+            count += 1
+    return count, b"".join(records)
+
+
+def compile_track(source, target, shapes=None):
+    """Write the compiled form of a TMX file.
+
+    shapes is a list from extract_shapes; by default the TMX file is
+    parsed for them with parse_track.
+    """
+    root = ElementTree.parse(source).getroot()
+    width = int(root.get("width"))
+    height = int(root.get("height"))
+    properties = list()
+    props_node = root.find("properties")
+    if props_node is not None:
+        for prop in props_node.findall("property"):
+            properties.append((prop.get("name"), prop.get("value")))
+    if shapes is None:
+        shapes = parse_track(source)[1]
+    shape_count, shape_data = pack_shapes(shapes)
+
+    layers = root.findall("layer")
+    chunks = [HEADER.pack(MAGIC, VERSION, width, height,
+                          int(root.get("tilewidth")),
+                          int(root.get("tileheight")),
+                          len(properties), len(layers), shape_count)]
+    for name, value in properties:
+        chunks.append(pack_string(name))
+        chunks.append(pack_string(value))
+    offset = sum(len(c) for c in chunks)
+    for layer in layers:
+        name = pack_string(layer.get("name"))
+        # Align the gids so they can be viewed in place.
+        padding = -(offset + len(name)) % 4
+        data = read_layer_data(layer.find("data"), width, height)
+        chunks.extend((name, b"\0" * padding, data))
+        offset += len(name) + padding + len(data)
+    chunks.append(shape_data)
+
+    directory = os.path.dirname(os.path.abspath(target))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, "wb") as fp:
+        for chunk in chunks:
+            fp.write(chunk)
+    os.rename(tmp_path, target)
+    logger.debug("Compiled %s to %s" % (source, target))
+
+
+class TrackFile(object):
+    """A compiled track, memory-mapped.
+
+    Layers are NumPy views of the file, (height, width) arrays of Tiled
+    gids, so nothing is parsed or copied per tile.  The map properties
+    name, description and thumbnail are attributes, as on a pytmx map.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as fp:
+            self.data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        data = self.data
+        (magic, version, self.width, self.height, self.tilewidth,
+         self.tileheight, prop_count, layer_count,
+         self.shape_count) = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a version %d track"
+                             % (path, VERSION))
+        offset = HEADER.size
+
+        self.properties = dict()
+        for i in range(prop_count):
+            name, offset = self.read_string(offset)
+            value, offset = self.read_string(offset)
+            self.properties[name] = value
+        self.name = self.properties.get("name")
+        self.description = self.properties.get("description")
+        self.thumbnail = self.properties.get("thumbnail")
+
+        self.layers = list()
+        self.layer_names = list()
+        cells = self.width * self.height
+        for i in range(layer_count):
+            name, offset = self.read_string(offset)
+            offset += -offset % 4
+            gids = numpy.frombuffer(data, dtype="<u4", count=cells,
+                                    offset=offset)
+            self.layers.append(gids.reshape(self.height, self.width))
+            self.layer_names.append(name)
+            offset += cells * 4
+        self.shapes_offset = offset
+
+    def read_string(self, offset):
+        length, = LENGTH.unpack_from(self.data, offset)
+        start = offset + LENGTH.size
+        value = self.data[start:start + length].decode("utf-8")
+        return value, start + length
+
+    def get_layer(self, name):
+        return self.layers[self.layer_names.index(name)]
+
+    def shape_offsets(self):
+        """Offset of every record in the shape table"""
+        data = self.data
+        offset = self.shapes_offset
+        offsets = list()
+        for i in range(self.shape_count):
+            offsets.append(offset)
+            vert_count = SHAPE.unpack_from(data, offset)[1]
+            offset += SHAPE.size + vert_count * VERTEX.size
+        return offsets
+
+    def read_shape(self, offset):
+        """Return the (body, geometry, attrs) record at offset"""
+        data = self.data
+        fields = SHAPE.unpack_from(data, offset)
+        offset += SHAPE.size
+        (kind, vert_count, mass, moment, x, y, angle,
+         radius) = fields[:8]
+        attrs = fields[8:13] + (bool(fields[13]),)
+        verts = list()
+        for j in range(vert_count):
+            verts.append(VERTEX.unpack_from(data, offset))
+            offset += VERTEX.size
+
+        kind = KINDS[kind]
+        if kind == "poly":
+            geometry = ("poly", verts)
+        elif kind == "segment":
+            geometry = ("segment", verts[0], verts[1], radius)
+        else:
+            geometry = ("circle", radius, verts[0])
+
+        if math.isnan(mass):
+            body = (None, (x, y), angle)
+        else:
+            body = ((mass, moment), (x, y), angle)
+        return body, geometry, attrs
+
+    def read_shapes(self, offsets):
+        """The records at offsets, as a list like extract_shapes returns"""
+        bodies = list()
+        last_body = None
+        for offset in offsets:
+            body, geometry, attrs = self.read_shape(offset)
+            # Shapes of one body are stored one after another.
+            if body != last_body:
+                bodies.append((body, list()))
+                last_body = body
+            bodies[-1][1].append((geometry, attrs))
+        return bodies
+
+    def shapes(self):
+        """The collision shapes, as a list like extract_shapes returns"""
+        return self.read_shapes(self.shape_offsets())
+
+    def close(self):
+        self.layers = list()
+        self.data.close()
+
+
+def compiled_path(source, directory=None):
+    base = os.path.splitext(os.path.basename(source))[0] + EXTENSION
+    return os.path.join(directory or os.path.dirname(source), base)
+
+
+def open_track(source, directory=None, load=None):
+    """TrackFile for a TMX file, compiling it first if it is out of date.
+
+    The compiled file is kept next to the TMX file, or in directory.
+    load, when given, is called with source for the (tilemap, shapes)
+    to compile from instead of parsing the TMX file again.
+    """
+    target = compiled_path(source, directory)
+    if (os.path.exists(target)
+            and os.path.getmtime(target) >= os.path.getmtime(source)):
+        try:
+            return TrackFile(target)
+        except ValueError as ex:
+            logger.debug("Recompiling %s: %s" % (source, ex))
+    shapes = None
+    if load is not None:
+        shapes = load(source)[1]
+    compile_track(source, target, shapes)
+    return TrackFile(target)
+
+
+def main():
+    parser = ArgumentParser(prog="platakart.trackfile",
+                            description="Compile TMX tracks")
+    parser.add_argument("tracks", nargs="*",
+                        help="TMX files (defaults to the test tracks)")
+    parser.add_argument("--output-dir", default=None,
+                        help="Where to write compiled tracks "
+                        "(defaults to next to each TMX file)")
+    parser.add_argument(
+        "--log-level",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+        default="WARNING", help="Verbosity of logging output")
+    args = parser.parse_args()
+    logging.basicConfig(level=getattr(logging, args.log_level))
+
+    sources = args.tracks or sorted(
+        glob.glob(os.path.join(RESOURCE_PATH, "testtrack*.tmx")))
+    for source in sources:
+        target = compiled_path(source, args.output_dir)
+        compile_track(source, target)
+        track = TrackFile(target)
+        print("%s: %d layers, %d shapes, %d bytes" % (
+            target, len(track.layers), track.shape_count,
+            os.path.getsize(target)))
+        track.close()
+
+
+if __name__ == "__main__":
+    main()
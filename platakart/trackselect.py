@@ -16,11 +16,15 @@ from pygame import K_UP
 
 logger = logging.getLogger("platakart.trackselect")
 
+from platakart.dispatch import subscriptions
+from platakart.fonts import fonts
 from platakart.ui import BLACK
 from platakart.ui import BLUE
 from platakart.ui import WHITE
 from platakart.ui import Button
+from platakart.ui import Compositor
 from platakart.ui import Scene
+from platakart.ui import TextSprite
 
 
 TrackInfo = namedtuple("TrackInfo", "key, name, description, thumbnail")
@@ -40,20 +44,22 @@ class TrackButton(pygame.sprite.DirtySprite):
             self.hover_surf, BLUE, highlight_rect, 8)
         self.track_info = track_info
         self.rect = self.image.get_rect()
-        label_surf = font.render(track_info.name, True, WHITE)
+        label_surf = fonts.render(font, track_info.name, WHITE)
         label_rect = label_surf.get_rect()
         label_rect.center = self.rect.center
         self.font = font
         self.thumb_surf.blit(label_surf, label_rect)
         self.hover_surf.blit(label_surf, label_rect)
-        pub.subscribe(self.on_mouse_move, "input.mouse-move")
+        subscriptions.subscribe(self.on_mouse_move, "input.mouse-move")
 
     def on_mouse_move(self, pos, rel, buttons):
         if self.rect.collidepoint(pos):
-            self.image = self.hover_surf
-            self.dirty = 1
+            if self.image is not self.hover_surf:
+                self.image = self.hover_surf
+                self.dirty = 1
         elif self.image is self.hover_surf:
             self.image = self.thumb_surf
+            self.dirty = 1
 
     def on_mouse_up(self, pos, button):
         if self.rect.collidepoint(pos):
@@ -70,10 +76,7 @@ class TrackButtonBar(pygame.sprite.RenderUpdates):
         self.tiles_to_show = 0
         self.rect = rect
         self.dirty = True
-        pub.subscribe(self.on_key_up, "input.key-up")
-
-    def __del__(self):
-        pub.unsubscribe(self.on_key_up, "input.key-up")
+        subscriptions.subscribe(self.on_key_up, "input.key-up")
 
     def update(self):
         """Reposition all of the images based on the selected_index"""
@@ -87,17 +90,15 @@ class TrackButtonBar(pygame.sprite.RenderUpdates):
 
         if key == K_LEFT or key == K_UP:
             self.selected_index -= 1
-            pub.sendMessage("game.stop-sound", name="menu-switch")
             pub.sendMessage("game.play-sound", name="menu-switch")
         elif key == K_RIGHT or key == K_DOWN:
             self.selected_index += 1
-            pub.sendMessage("game.stop-sound", name="menu-switch")
             pub.sendMessage("game.play-sound", name="menu-switch")
 
         buttons = [s for s in self.sprites()]
         for button in buttons:
             button.visible = 0
-            button.dirty = 0
+            button.dirty = 1
             button.rect.topleft = -128, -128
 
         self.selected_index = max(
@@ -107,6 +108,7 @@ class TrackButtonBar(pygame.sprite.RenderUpdates):
         center_button = buttons[idx]
         center_button.rect.center = self.rect.center
         center_button.rect.left += 4
+        center_button.visible = 1
 
         if idx - 1 != -1:
             top_button = buttons[idx-1]
@@ -114,7 +116,6 @@ class TrackButtonBar(pygame.sprite.RenderUpdates):
             top_button.rect.left -= 4
             top_button.rect.top -= 164
             top_button.visible = 1
-            top_button.dirty = 1
 
         if idx < len(buttons) - 1:
             bottom_button = buttons[idx+1]
@@ -122,7 +123,6 @@ class TrackButtonBar(pygame.sprite.RenderUpdates):
             bottom_button.rect.left -= 4
             bottom_button.rect.bottom += 164
             bottom_button.visible = 1
-            bottom_button.dirty = 1
 
         self.dirty = True
 
@@ -141,47 +141,51 @@ class TrackSelectScene(Scene):
         self.rendered = False
         logger.debug("Setting up kart select scene")
         logger.debug("kart_id: %s" % options["kart_id"])
-        self.font = pygame.font.SysFont("Verdana", 32)
+        self.font = self.resources.fonts.get("menu")
         self.track_buttons = TrackButtonBar(pygame.Rect(19, 16, 128, 480))
-        font = pygame.font.SysFont("Verdana", 32)
-        for key, tilemap in self.resources.tilemaps.items():
-            info = TrackInfo(key, tilemap.name, tilemap.description,
-                             tilemap.thumbnail)
+        for key, track in self.resources.tracks.items():
+            info = TrackInfo(key, track.name, track.description,
+                             track.thumbnail)
             img = self.resources.images[info.thumbnail]
             self.track_buttons.add(
-                TrackButton(font, img, info))
+                TrackButton(self.font, img, info))
         self.track_buttons.on_key_up(None, None)
         self.go_button = Button("go", "Go!", self.font, (400, 400),
                                 self.resources.images["red_button_up"],
                                 self.resources.images["red_button_down"])
-        pub.subscribe(self.on_button_clicked, "button.clicked")
+        self.compositor = Compositor(self.resources.images["track-select"],
+                                     self.track_buttons.sprites(),
+                                     self.go_button)
+        self.info_sprites = list()
+        subscriptions.subscribe(self.on_button_clicked, "button.clicked")
 
     def teardown(self):
         logger.debug("Tearing down track select scene")
         self.buttons = None
-        pub.unsubscribe(self.on_button_clicked, "button.clicked")
+        self.compositor = None
+        self.info_sprites = None
+
+    def show_track_info(self, track_info):
+        for sprite in self.info_sprites:
+            sprite.kill()
+        self.info_sprites = [TextSprite(self.font, WHITE, (200, 80),
+                                        track_info.name)]
+        height = self.info_sprites[0].rect.height
+        margin = 8
+        for i, line in enumerate(track_info.description.split("|")):
+            top = 80 + (height + margin) * (i + 1)
+            self.info_sprites.append(
+                TextSprite(self.font, WHITE, (200, top), line.strip()))
+        self.compositor.add(self.info_sprites)
 
     def update(self, screen, delta):
         if self.track_buttons.dirty:
-            screen_rect = screen.get_rect()
-            screen.blit(self.resources.images["track-select"], screen_rect)
-
             self.rendered = True
             self.track_buttons.update()
-            self.track_buttons.draw(screen)
-
-            track_info = self.track_buttons.get_selected_track()
-            
-            surf = self.font.render(track_info.name, True, WHITE)
-            surf_rect = screen.blit(surf, (200, 80))
-            margin = 8
-            for i, line in enumerate(track_info.description.split("|")):
-                surf_rect.top = 80 + (surf_rect.height + margin) * (i + 1)
-                surf = self.font.render(line.strip(), True, WHITE)
-                screen.blit(surf, surf_rect)
-
-            screen.blit(self.go_button.image, self.go_button.rect)
-            pygame.display.flip()
+            self.show_track_info(self.track_buttons.get_selected_track())
+            self.track_buttons.dirty = False
+
+        self.compositor.present(screen)
 
     def on_button_clicked(self, id):
         logger.debug("Track {%s} selected" % id)
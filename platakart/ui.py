@@ -3,6 +3,11 @@
 from pubsub import pub
 import pygame.sprite
 
+from platakart.dispatch import subscriptions
+from platakart.display import display
+from platakart.fonts import fonts
+from platakart.profiler import NULL_PROFILER
+
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
 BLUE = (0, 0, 255)
@@ -13,6 +18,9 @@ RED = (255, 0, 0)
 # helps to avoid forward declarations in core.py.
 class Scene(object):
 
+    # Replaced by the game's FrameProfiler when profiling is on.
+    profiler = NULL_PROFILER
+
     def get_name(self):
         raise NotImplemented
 
@@ -22,6 +30,19 @@ class Scene(object):
     def teardown(self):
         pass
 
+    def get_resources(self, options=None):
+        """Resources needed on top of the scene's resources.ini manifest"""
+        return list()
+
+    def prepare(self, options=None):
+        """Do the slow parts of setup early, while another scene runs.
+
+        A generator, advanced once a frame after the scene's resources
+        are loaded; setup uses whatever was prepared for the same
+        options.
+        """
+        return iter(())
+
     def update(self, screen, delta):
         pass
 
@@ -38,7 +59,7 @@ class Button(pygame.sprite.DirtySprite):
         self.up_rect = self.up_surf.get_rect()
         self.down_surf = down_surf.copy()
         self.down_rect = self.down_surf.get_rect()
-        label_surf = font.render(label, True, WHITE)
+        label_surf = fonts.render(font, label, WHITE)
         label_rect = label_surf.get_rect()
         label_rect.center = self.up_rect.center
         self.up_surf.blit(label_surf, label_rect)
@@ -49,9 +70,9 @@ class Button(pygame.sprite.DirtySprite):
         self.down_rect.top += 4
         self.rect = self.up_rect
         self.image = self.up_surf
-        pub.subscribe(self.on_mouse_down, "input.mouse-down")
-        pub.subscribe(self.on_mouse_up, "input.mouse-up")
-        pub.subscribe(self.on_mouse_move, "input.mouse-move")
+        subscriptions.subscribe(self.on_mouse_down, "input.mouse-down")
+        subscriptions.subscribe(self.on_mouse_up, "input.mouse-up")
+        subscriptions.subscribe(self.on_mouse_move, "input.mouse-move")
 
     def on_mouse_down(self, pos, button):
         if self.rect.collidepoint(pos):
@@ -73,3 +94,51 @@ class Button(pygame.sprite.DirtySprite):
                 self.image = self.up_surf
                 self.rect = self.up_rect
                 self.dirty = 1
+
+
+class TextSprite(pygame.sprite.DirtySprite):
+
+    def __init__(self, font, color, pos, text="", anchor="topleft"):
+        super(TextSprite, self).__init__()
+        self.font = font
+        self.color = color
+        self.pos = pos
+        self.anchor = anchor
+        self.text = None
+        self.set_text(text)
+
+    def set_text(self, text):
+        if text == self.text:
+            return
+        self.text = text
+        self.image = fonts.render(self.font, text, self.color)
+        self.rect = self.image.get_rect(**{self.anchor: self.pos})
+        self.dirty = 1
+
+
+class Compositor(pygame.sprite.LayeredDirty):
+    """Draws only the sprites that changed over a cached background.
+
+    Sprites must be DirtySprites and set dirty when they change.  present
+    draws them and pushes just the changed rects to the display, so a
+    frame where nothing changed costs next to nothing.
+    """
+
+    def __init__(self, background, *sprites):
+        super(Compositor, self).__init__(*sprites)
+        self.background = background
+        self.needs_repaint = True
+
+    def invalidate(self):
+        """Repaint the whole screen on the next present"""
+        self.needs_repaint = True
+
+    def present(self, screen):
+        if self.needs_repaint:
+            self.clear(screen, self.background)
+            self.repaint_rect(screen.get_rect())
+            self.needs_repaint = False
+        rects = self.draw(screen)
+        if rects:
+            display.update(rects)
+        return rects
@@ -0,0 +1,119 @@
+# -*- coding: utf-8; -*-
+
+import logging
+
+import pygame.mixer
+
+logger = logging.getLogger("platakart.voices")
+
+# group, priority, most voices at once (0 for no limit)
+DEFAULT_SPEC = ("ui", 0, 0)
+
+
+class VoiceManager(object):
+    """Plays sounds on mixer channels reserved for their group.
+
+    Each group (ui, kart, ...) gets its own channels, from the
+    [channel-groups] section of resources.ini, so a burst of kart sounds
+    can't take the menu's channels.  A sound with a limit that is
+    already playing that many times restarts its oldest voice.  When a
+    group is full, its oldest voice with a lower or equal priority is
+    stolen; if there is none the new sound is dropped.  Voices are taken
+    over with Channel.play, with no stop in between.
+    """
+
+    def __init__(self, groups, specs):
+        self.group_sizes = groups
+        self.specs = specs
+        self.groups = dict()
+        # channel -> (name, priority, play number)
+        self.voices = dict()
+        self.plays = 0
+        self.stolen = 0
+        self.dropped = 0
+
+    def init(self):
+        """Reserve the channels; call after pygame.mixer.init"""
+        total = sum(count for name, count in self.group_sizes)
+        # Keep the mixer's usual channels free for a bare Sound.play,
+        # which never picks a reserved channel.
+        pygame.mixer.set_num_channels(
+            total + pygame.mixer.get_num_channels())
+        pygame.mixer.set_reserved(total)
+        first = 0
+        for name, count in self.group_sizes:
+            self.groups[name] = [pygame.mixer.Channel(i)
+                                 for i in range(first, first + count)]
+            first += count
+        logger.debug("Reserved %d mixer channels" % total)
+
+    def active(self, channels):
+        voices = list()
+        for channel in channels:
+            voice = self.voices.get(channel)
+            if voice is None:
+                continue
+            if channel.get_busy():
+                voices.append((voice[2], channel, voice))
+            else:
+                del self.voices[channel]
+        voices.sort()
+        return voices
+
+    def choose_channel(self, name, group, priority, limit):
+        channels = self.groups[group]
+        playing = self.active(channels)
+        if limit:
+            same = [channel for n, channel, voice in playing
+                    if voice[0] == name]
+            if len(same) >= limit:
+                return same[0]
+
+        busy = set(channel for n, channel, voice in playing)
+        for channel in channels:
+            if channel not in busy:
+                return channel
+
+        for n, channel, voice in playing:
+            if voice[1] <= priority:
+                self.stolen += 1
+                logger.debug("Stealing %s's channel for %s"
+                             % (voice[0], name))
+                return channel
+        return None
+
+    def play(self, name, sound, loops=0, maxtime=0, fade_ms=0):
+        group, priority, limit = self.specs.get(name, DEFAULT_SPEC)
+        if group not in self.groups:
+            logger.warning("Sound %s has no %s channels" % (name, group))
+            sound.play(loops, maxtime, fade_ms)
+            return
+        channel = self.choose_channel(name, group, priority, limit)
+        if channel is None:
+            self.dropped += 1
+            logger.debug("Dropped %s, %s channels are busy" % (name, group))
+            return
+        channel.play(sound, loops, maxtime, fade_ms)
+        self.plays += 1
+        self.voices[channel] = (name, priority, self.plays)
+
+    def stop(self, name, fade_ms=0):
+        for channel, voice in list(self.voices.items()):
+            if voice[0] != name:
+                continue
+            if fade_ms:
+                channel.fadeout(fade_ms)
+            else:
+                channel.stop()
+                del self.voices[channel]
+
+    def stats(self):
+        """Voice counters; dropped and stolen are reset on each call"""
+        active = dict()
+        for group, channels in self.groups.items():
+            active[group] = len(self.active(channels))
+        result = {"active": active,
+                  "stolen": self.stolen,
+                  "dropped": self.dropped}
+        self.stolen = self.dropped = 0
+        return result